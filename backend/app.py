@@ -1,41 +1,110 @@
 import os
-from flask import Flask, request, abort, jsonify, redirect, url_for
+from flask import Flask, request, abort, jsonify, stream_with_context
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from flask_cors import CORS
 from werkzeug.exceptions import NotFound
 import requests
 from dotenv import load_dotenv
 from .database.models import setup_db, db, Movie, Actor, Casting
-from .auth.auth import AuthError, requires_auth
+from .database.pool import pool_status
+from .database.replicas import read_only
+from .database.bulk import (
+    validate_movies, validate_actors, validate_castings, bulk_insert
+)
+from .database.castings import add_casting, replace_cast, CastingExists, UnknownActors
+from .database.queries import (
+    read_movies, read_actors, iter_movies, iter_actors, movie_filters, actor_filters
+)
+from .auth.auth import AuthError, requires_auth, token_cache
+from .auth.auth0 import Auth0Client, CircuitBreaker, CircuitOpenError
+from .cache.cache import response_cache, list_etag
+from .export.export import ndjson_export, csv_export
+from .compression.compression import COMPRESSORS, encoded_etag, init_compression, negotiate
+from .metrics.metrics import init_metrics
+from .spa.spa import init_spa, spa_index
+from .json_provider import json_provider_class
+from .ingest.ingest import import_cli
 
 
 def create_app(test_config=None):
 
     app = Flask(__name__, static_folder='../frontend/dist/', static_url_path='/')
+    app.json = json_provider_class()(app)
+    # first, so that its after_request hook runs after every other one
+    init_metrics(app)
     if test_config is not None:
-        setup_db(app, test_config['database_path'])
+        setup_db(app, test_config['database_path'], test_config.get('replica_paths', []))
     else:
         setup_db(app)
     CORS(app)
+    init_compression(app)
+    app.cli.add_command(import_cli)
+
+    PAGE_LIMIT_DEFAULT = int(os.getenv("PAGE_LIMIT_DEFAULT", 100))
+    PAGE_LIMIT_MAX = int(os.getenv("PAGE_LIMIT_MAX", 500))
+    STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 65536))
+    BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
 
     AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
     CLIENT_ID = os.getenv("CLIENT_ID")
     CLIENT_SECRET = os.getenv("CLIENT_SECRET")
     API_AUDIENCE = os.getenv("API_AUDIENCE")
+    AUTH0_TOKEN_URL = os.getenv("AUTH0_TOKEN_URL", f"https://{AUTH0_DOMAIN}/oauth/token")
+
+    # one pooled keep-alive session per app for the token exchange
+    auth0_client = Auth0Client(
+        AUTH0_TOKEN_URL,
+        connect_timeout=float(os.getenv("AUTH0_CONNECT_TIMEOUT", 3.05)),
+        read_timeout=float(os.getenv("AUTH0_READ_TIMEOUT", 10)),
+        retries=int(os.getenv("AUTH0_RETRIES", 2)),
+        backoff=float(os.getenv("AUTH0_RETRY_BACKOFF", 0.5)),
+        max_retry_wait=float(os.getenv("AUTH0_MAX_RETRY_WAIT", 1)),
+        pool_size=int(os.getenv("AUTH0_POOL_SIZE", 10)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("AUTH0_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("AUTH0_BREAKER_RESET", 30))
+        )
+    )
+    app.extensions["auth0_client"] = auth0_client
 
     #  ----------------------------------------------------------------
     #  Home
     #  ----------------------------------------------------------------
 
-    @app.route('/', defaults={'path': ''})
-    @app.route('/<path:path>')
-    def catch_all(path):
-        return app.send_static_file("index.html")
-
-    @app.errorhandler(NotFound)
-    def not_found(error):
-        return redirect(url_for('catch_all'))
+    # only '/', every other client route reaches index.html through the
+    # static rule, see init_spa
+    @app.route('/')
+    def index():
+        return spa_index.response(app)
     
+    #  ----------------------------------------------------------------
+    #  Health
+    #  ----------------------------------------------------------------
+
+    # Database reachability, connection pool and token cache metrics of this worker
+    @app.route('/health', methods=['GET'])
+    def health():
+        try:
+            db.session.execute(db.text('SELECT 1'))
+            database = True
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+            database = False
+
+        return (
+            jsonify({
+                "success": database,
+                "data": {
+                    "database": "ok" if database else "unavailable",
+                    "pool": pool_status(db.engine),
+                    "token_cache": token_cache.stats()
+                }
+            }),
+            200 if database else 503
+        )
+
     #  ----------------------------------------------------------------
     #  Log In
     #  ----------------------------------------------------------------
@@ -47,7 +116,6 @@ def create_app(test_config=None):
             username = body.get('username')
             password = body.get('password')
 
-            url = f'https://{AUTH0_DOMAIN}/oauth/token'
             payload = {
                 "username":username,
                 "password":password,
@@ -56,26 +124,30 @@ def create_app(test_config=None):
                 "audience":API_AUDIENCE,
                 "grant_type":"password"
             }
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(url, json=payload, headers=headers)
-
-            if response.status_code == 200:
-                response = response.json()
-                return jsonify(
-                    {
-                        "success": True,
-                        "data": {
-                            "access_token": response.get('access_token'),
-                            "expires_in": response.get('expires_in')
-                        }
-                    }
-                )
-            else:
-                abort(422)
+            response = auth0_client.request_token(payload)
+        except (CircuitOpenError, requests.RequestException) as e:
+            # Auth0 is down or too slow, fail fast instead of holding the worker
+            print(e)
+            abort(503)
         except Exception as e:
             print(e)
             abort(500)
 
+        if response.status_code in Auth0Client.RETRY_STATUSES:
+            abort(503)
+        if response.status_code != 200:
+            abort(422)
+        response = response.json()
+        return jsonify(
+            {
+                "success": True,
+                "data": {
+                    "access_token": response.get('access_token'),
+                    "expires_in": response.get('expires_in')
+                }
+            }
+        )
+
     #  ----------------------------------------------------------------
     #  CORS Headers
     #  ----------------------------------------------------------------
@@ -90,6 +162,147 @@ def create_app(test_config=None):
         )
         return response
     
+    #  ----------------------------------------------------------------
+    #  Pagination
+    #  ----------------------------------------------------------------
+
+    # ?paginate=false keeps the original unpaginated response for existing
+    # clients, otherwise lists are returned one keyset page at a time
+    def get_page_args():
+        if request.args.get("paginate", "true").lower() == "false":
+            return None, None
+        try:
+            limit = int(request.args.get("limit", PAGE_LIMIT_DEFAULT))
+        except ValueError:
+            abort(400)
+        if limit < 1:
+            abort(400)
+        return min(limit, PAGE_LIMIT_MAX), request.args.get("after", None)
+
+    def page_response(data, next_cursor, limit):
+        body = {
+            "success": True,
+            "data": data
+        }
+        if limit is not None:
+            body["next"] = next_cursor
+        return jsonify(body)
+
+    # ?stream=true sends the whole list (same envelope as ?paginate=false)
+    # as it is read from a server-side cursor, in chunks of STREAM_CHUNK_SIZE
+    def wants_stream():
+        return request.args.get("stream", "false").lower() == "true"
+
+    def stream_response(rows, etag):
+        envelope = app.json.dumps({"data": [], "success": True}, separators=(",", ":"))
+        head, tail = envelope.split("[]", 1)
+
+        def generate():
+            chunk = [head, "["]
+            size = 0
+            separator = ""
+            for row in rows:
+                item = separator + app.json.dumps(row, separators=(",", ":"))
+                separator = ","
+                chunk.append(item)
+                size += len(item)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield "".join(chunk)
+                    chunk = []
+                    size = 0
+            chunk.append("]" + tail + "\n")
+            yield "".join(chunk)
+
+        response = app.response_class(
+            stream_with_context(generate()), mimetype=app.json.mimetype
+        )
+        response.set_etag(etag)
+        return response
+
+    # List responses carry a strong ETag built from the table versions, a
+    # matching If-None-Match gets a 304 before any list query runs. Otherwise
+    # they are cached as bytes per namespace and query string.
+    # requires_auth has already run by the time these are called
+    def not_modified(etag):
+        # the client holds the identity representation or the compressed
+        # one it accepts (small lists are sent uncompressed); the 304 repeats
+        # the ETag it matched and the Vary of the 200
+        candidates = [etag]
+        encoding = negotiate(COMPRESSORS)
+        if encoding is not None:
+            candidates.append(encoded_etag(etag, encoding))
+        for candidate in candidates:
+            if request.if_none_match.contains_weak(candidate):
+                response = app.response_class(status=304)
+                response.set_etag(candidate)
+                response.vary.add("Accept-Encoding")
+                return response
+
+    # Entries are also keyed by the ETag, which comes from the table versions
+    # in the database: a worker whose in-process cache missed another
+    # worker's invalidation, or a lagging replica, never serves an old body
+    # under a new ETag
+    def entry_key(cache_key, etag):
+        if cache_key is not None:
+            return f"{cache_key}:{etag}"
+        return cache_key
+
+    def cached_response(cache_key, etag):
+        body = response_cache.get(entry_key(cache_key, etag))
+        if body is not None:
+            response = app.response_class(body, mimetype=app.json.mimetype)
+            response.set_etag(etag)
+            return response
+
+    def cache_response(cache_key, etag, response):
+        response_cache.set(entry_key(cache_key, etag), response.get_data())
+        response.set_etag(etag)
+        return response
+
+    #  ----------------------------------------------------------------
+    #  Bulk Create
+    #  ----------------------------------------------------------------
+
+    # Accepts a JSON array (or {"data": [...]}) of up to BULK_MAX_ITEMS items.
+    # Nothing is written unless every item is valid, the per-item errors are
+    # reported otherwise. Valid items are inserted in one transaction.
+    def bulk_create(model, validate):
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get("data")
+        if not isinstance(items, list) or not items or len(items) > BULK_MAX_ITEMS:
+            abort(400)
+
+        try:
+            rows, errors = validate(items)
+            if errors:
+                db.session.rollback()
+                return (
+                    jsonify({
+                        "success": False,
+                        "error": 422,
+                        "message": "Unprocessable Entity",
+                        "errors": errors
+                    }),
+                    422
+                )
+
+            ids = bulk_insert(model, rows)
+            db.session.commit()
+
+            return jsonify({
+                "success": True,
+                "data": ids
+            })
+        except IntegrityError as e:
+            db.session.rollback()
+            print(e)
+            abort(422)
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+            abort(500)
+
     #  ----------------------------------------------------------------
     #  Movies
     #  ----------------------------------------------------------------
@@ -97,30 +310,40 @@ def create_app(test_config=None):
     # Read all movies
     @app.route("/movies", methods=["GET"])
     @requires_auth("get:movies")
+    @read_only
     def readAllMovie(payload):
+        limit, after = get_page_args()
+        etag = list_etag("movies", request.args)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        if wants_stream():
+            try:
+                rows = iter_movies(
+                    sort=request.args.get("sort", "id"),
+                    filters=movie_filters(request.args)
+                )
+            except ValueError as e:
+                print(e)
+                abort(400)
+            return stream_response(rows, etag)
+        cache_key = response_cache.key("movies", request.args)
+        cached = cached_response(cache_key, etag)
+        if cached is not None:
+            return cached
+
         try:
-            movies = []
-            
-            results = Movie.query.all()
-            for result in results:
-                actors = []
-                for casting in result.casting:
-                    actors.append({
-                        "id": casting.actor_id,
-                        "name": casting.actor.name
-                    })
-
-                data = result.format()
-                data["actors"] = actors
-
-                movies.append(data)
-
-            return jsonify(
-                {
-                    "success": True,
-                    "data": movies
-                }
+            movies, next_cursor = read_movies(
+                limit=limit,
+                after=after,
+                sort=request.args.get("sort", "id"),
+                filters=movie_filters(request.args)
             )
+
+            return cache_response(cache_key, etag, page_response(movies, next_cursor, limit))
+        except ValueError as e:
+            print(e)
+            abort(400)
         except Exception as e:
             print(e)
             abort(500)
@@ -147,6 +370,12 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
+    # Add movies in bulk
+    @app.route("/movies/bulk", methods=["POST"])
+    @requires_auth("post:movies")
+    def createMovies(payload):
+        return bulk_create(Movie, validate_movies)
+
     # Edit movies
     @app.route("/movies/<id>", methods=["PATCH"])
     @requires_auth("patch:movies")
@@ -202,30 +431,40 @@ def create_app(test_config=None):
     # Read all actors
     @app.route("/actors", methods=["GET"])
     @requires_auth("get:actors")
+    @read_only
     def readAllActor(payload):
+        limit, after = get_page_args()
+        etag = list_etag("actors", request.args)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        if wants_stream():
+            try:
+                rows = iter_actors(
+                    sort=request.args.get("sort", "id"),
+                    filters=actor_filters(request.args)
+                )
+            except ValueError as e:
+                print(e)
+                abort(400)
+            return stream_response(rows, etag)
+        cache_key = response_cache.key("actors", request.args)
+        cached = cached_response(cache_key, etag)
+        if cached is not None:
+            return cached
+
         try:
-            actors = []
-            
-            results = Actor.query.all()
-            for result in results:
-                movies = []
-                for casting in result.casting:
-                    movies.append({
-                        "id": casting.movie_id,
-                        "title": casting.movie.title
-                    })
-
-                data = result.format()
-                data["movies"] = movies
-
-                actors.append(data)
-            
-            return jsonify(
-                {
-                    "success": True,
-                    "data": actors
-                }
+            actors, next_cursor = read_actors(
+                limit=limit,
+                after=after,
+                sort=request.args.get("sort", "id"),
+                filters=actor_filters(request.args)
             )
+
+            return cache_response(cache_key, etag, page_response(actors, next_cursor, limit))
+        except ValueError as e:
+            print(e)
+            abort(400)
         except Exception as e:
             print(e)
             abort(500)
@@ -253,6 +492,12 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
+    # Add actors in bulk
+    @app.route("/actors/bulk", methods=["POST"])
+    @requires_auth("post:actors")
+    def createActors(payload):
+        return bulk_create(Actor, validate_actors)
+
     # Edit actors
     @app.route("/actors/<id>", methods=["PATCH"])
     @requires_auth("patch:actors")
@@ -317,27 +562,88 @@ def create_app(test_config=None):
             movie_id = body.get("movie", None)
             actor_id = body.get("actor", None)
 
-            movie = Movie.query.filter(Movie.id == movie_id).one()
-            actor = Actor.query.filter(Actor.id == actor_id).one()
-
-            casting = Casting(
-                movie_id = movie_id,
-                actor_id = actor_id
-            )
-            db.session.add(casting)
+            add_casting(movie_id, actor_id)
             db.session.commit()
 
             return jsonify({
                 "success": True
             })
         except NoResultFound as e:
+            db.session.rollback()
             print(e)
             raise NoResultFound
+        except (CastingExists, IntegrityError) as e:
+            # the actor is already cast in the movie
+            db.session.rollback()
+            print(e)
+            abort(422)
         except Exception as e:
             db.session.rollback()
             print(e)
             abort(500)
 
+    # Replace the whole cast of a movie
+    @app.route("/movies/<int:id>/casting", methods=["PUT"])
+    @requires_auth("post:casting")
+    def replaceCasting(payload, id):
+        body = request.get_json(silent=True) or {}
+        actor_ids = body.get("actors")
+        if not isinstance(actor_ids, list) or not all(
+            isinstance(actor_id, int) and not isinstance(actor_id, bool) for actor_id in actor_ids
+        ):
+            abort(400)
+
+        try:
+            added, removed = replace_cast(id, actor_ids)
+            db.session.commit()
+
+            return jsonify({
+                "success": True,
+                "data": {
+                    "added": added,
+                    "removed": removed
+                }
+            })
+        except NoResultFound as e:
+            db.session.rollback()
+            print(e)
+            raise NoResultFound
+        except UnknownActors as e:
+            db.session.rollback()
+            print(e)
+            abort(422)
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+            abort(500)
+
+    # Add castings in bulk
+    @app.route("/casting/bulk", methods=["POST"])
+    @requires_auth("post:casting")
+    def createCastings(payload):
+        return bulk_create(Casting, validate_castings)
+
+    #  ----------------------------------------------------------------
+    #  Export
+    #  ----------------------------------------------------------------
+
+    # Export the whole casting graph, one row per (movie, actor) edge
+    @app.route("/export/castings.<any(ndjson, csv):format>", methods=["GET"])
+    @requires_auth(all_of=["get:movies", "get:actors"])
+    @read_only
+    def exportCastings(payload, format):
+        if format == "ndjson":
+            chunks = ndjson_export()
+            mimetype = "application/x-ndjson"
+        else:
+            chunks = csv_export()
+            mimetype = "text/csv"
+
+        # compressed on the fly by the compression middleware
+        response = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename=castings.{format}"
+        return response
+
     #  ----------------------------------------------------------------
     #  Errors
     #  ----------------------------------------------------------------
@@ -349,12 +655,12 @@ def create_app(test_config=None):
             400
         )
 
-    # @app.errorhandler(404)
-    # def not_found(error):
-    #     return (
-    #         jsonify({"success": False, "error": 404, "message": "Not Found"}),
-    #         404
-    #     )
+    @app.errorhandler(NotFound)
+    def not_found(error):
+        return (
+            jsonify({"success": False, "error": 404, "message": "Not Found"}),
+            404
+        )
 
     @app.errorhandler(422)
     def unprocessable_entity(error):
@@ -377,6 +683,13 @@ def create_app(test_config=None):
             500
         )
         
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return (
+            jsonify({"success": False, "error": 503, "message": "Service Unavailable"}),
+            503
+        )
+
     @app.errorhandler(NoResultFound)
     def no_result_found(error):
         return (
@@ -392,6 +705,9 @@ def create_app(test_config=None):
         )
 
 
+    # after every route, client routes and API misses are told apart by prefix
+    init_spa(app)
+
     return app
 
 
@@ -1,15 +1,34 @@
 import os
-import json
 from flask import request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 from dotenv import load_dotenv
+from .jwks import JWKSKeyStore, JWKSUnavailableError
+from .token_cache import TokenCache
+from ..metrics.metrics import auth_step, token_cache_event
 
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 ALGORITHMS = os.getenv("ALGORITHMS")
 API_AUDIENCE = os.getenv("API_AUDIENCE")
 
+# JWKS key cache
+JWKS_URL = os.getenv("JWKS_URL", f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.getenv("JWKS_TTL", 600))
+JWKS_MIN_REFETCH_INTERVAL = int(os.getenv("JWKS_MIN_REFETCH_INTERVAL", 30))
+JWKS_BACKGROUND_REFRESH = os.getenv("JWKS_BACKGROUND_REFRESH", "false").lower() == "true"
+
+jwks_store = JWKSKeyStore(
+    JWKS_URL,
+    ttl=JWKS_TTL,
+    min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+    background_refresh=JWKS_BACKGROUND_REFRESH
+)
+
+# Verified token cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE, on_event=token_cache_event)
+
 
 ## AuthError Exception
 '''
@@ -65,26 +84,76 @@ def get_token_auth_header():
     return token
 
 
+## Permissions
+'''
+Permissions
+A permission requirement compiled once, when requires_auth is applied
+
+all_of: every one of these permissions must be granted
+any_of: at least one of these permissions must be granted (ignored if empty)
+'''
+
+
+class Permissions:
+    def __init__(self, all_of=(), any_of=()):
+        self.all_of = frozenset(all_of)
+        self.any_of = frozenset(any_of)
+
+    def is_satisfied_by(self, granted):
+        if not self.all_of <= granted:
+            return False
+        return not self.any_of or not self.any_of.isdisjoint(granted)
+
+    def __repr__(self):
+        return f"Permissions(all_of={sorted(self.all_of)}, any_of={sorted(self.any_of)})"
+
+
+def compile_permissions(permission='', any_of=None, all_of=None):
+    if isinstance(permission, Permissions):
+        return permission
+    all_of = set(all_of or ())
+    if permission or not (all_of or any_of):
+        all_of.add(permission)
+    return Permissions(all_of=all_of, any_of=any_of or ())
+
+
+'''
+VerifiedPayload
+A decoded jwt payload (a plain dict to the handlers) that carries its
+permissions as a frozenset, built once and reused while the token is cached
+'''
+
+
+class VerifiedPayload(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        permissions = self.get('permissions')
+        self.permission_set = None if permissions is None else frozenset(permissions)
+
+
 '''
 @INPUTS
-    permission: string permission (i.e. 'post:drink')
+    permission: string permission (i.e. 'post:drink') or compiled Permissions
     payload: decoded jwt payload
 
 it should raise an AuthError if permissions are not included in the payload
     !!NOTE check your RBAC settings in Auth0
-it should raise an AuthError if the requested permission string is not in the payload permissions array
+it should raise an AuthError if the requested permissions are not granted by the payload permissions array
 return true otherwise
 '''
 
 
 def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-        raise AuthError({
-            'code': 'invalid_claims',
-            'description': 'Permissions not included in JWT.'
-        }, 400)
+    granted = getattr(payload, 'permission_set', None)
+    if granted is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        granted = frozenset(payload['permissions'])
 
-    if permission not in payload['permissions']:
+    if not compile_permissions(permission).is_satisfied_by(granted):
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -99,6 +168,7 @@ def check_permissions(permission, payload):
 
 it should be an Auth0 token with key id (kid)
 it should verify the token using Auth0 /.well-known/jwks.json
+    the key set is cached in jwks_store, see auth/jwks.py
 it should decode the payload from the token
 it should validate the claims
 return the decoded payload
@@ -108,36 +178,41 @@ return the decoded payload
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        with auth_step('jwks'):
+            rsa_key = jwks_store.get_key(unverified_header['kid'])
+    except JWKSUnavailableError as e:
+        print(e)
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
+
     if rsa_key:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with auth_step('verify'):
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
 
-            return payload
+            return VerifiedPayload(payload)
 
         except jwt.ExpiredSignatureError:
             raise AuthError({
@@ -164,21 +239,33 @@ def verify_decode_jwt(token):
 '''
 @INPUTS
     permission: string permission (i.e. 'post:drink')
+    any_of: optional permissions of which at least one is required
+    all_of: optional permissions which are all required
 
+the required permissions are compiled once, when the decorator is applied
 it should use the get_token_auth_header method to get the token
 it should use the verify_decode_jwt method to decode the jwt
+    unless the token was already verified and is still in token_cache
 it should use the check_permissions method validate claims and check the requested permission
+every step is timed into the auth_duration_seconds histogram, see metrics/metrics.py
 return the decorator which passes the decoded payload to the decorated method
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(permission='', any_of=None, all_of=None):
+    required = compile_permissions(permission, any_of=any_of, all_of=all_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with auth_step('token_cache'):
+                payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.set(token, payload)
+            with auth_step('permissions'):
+                check_permissions(required, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+## Auth0 Token Client
+'''
+Auth0Client
+Exchanges credentials for tokens at the Auth0 token endpoint over one shared
+requests.Session
+
+it should reuse pooled keep-alive connections instead of a new TCP and TLS
+    handshake per login
+it should bound every call with connect and read timeouts
+it should retry connection errors and 429/5xx answers a few times, with
+    exponential backoff and honouring Retry-After, waiting at most
+    max_retry_wait between attempts
+it should never retry a read timeout: a stalled Auth0 costs one
+    read_timeout, so /login stays well under the gunicorn worker timeout
+it should fail fast with CircuitOpenError once Auth0 kept failing, and let a
+    single trial call through after reset_timeout to find out if it recovered
+'''
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError('Auth0 is failing, not calling it for now.')
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._trial_running:
+                    raise CircuitOpenError('Auth0 is failing, a trial call is running.')
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning('opening the Auth0 circuit after %s failures', self.failures)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class CappedRetry(Retry):
+    '''
+    A urllib3 Retry whose backoff and Retry-After waits are capped at max_wait
+    '''
+    def __init__(self, *args, max_wait=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_wait = max_wait
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.max_wait = self.max_wait
+        return retry
+
+    def get_backoff_time(self):
+        return min(super().get_backoff_time(), self.max_wait)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.max_wait)
+
+
+class Auth0Client:
+    # answers worth retrying, and counted as failures by the breaker
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, token_url, connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff=0.5, max_retry_wait=1, pool_size=10, breaker=None):
+        self.token_url = token_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+
+        retry = CappedRetry(
+            total=retries,
+            # the answer may be on its way, waiting for it again would only
+            # add another read_timeout
+            read=0,
+            backoff_factor=backoff,
+            max_wait=max_retry_wait,
+            status_forcelist=self.RETRY_STATUSES,
+            # the password grant has no side effect, it is safe to repeat
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    '''
+    @INPUTS
+        payload: the token request body
+
+    return the requests.Response of the token endpoint
+    raise CircuitOpenError without calling Auth0 while the circuit is open,
+    requests.RequestException when Auth0 could not be reached
+    every outcome is recorded, whatever is raised, so a half-open trial
+    always ends
+    '''
+    def request_token(self, payload):
+        self.breaker.before_call()
+        succeeded = False
+        try:
+            response = self.session.post(self.token_url, json=payload, timeout=self.timeout)
+            succeeded = response.status_code not in self.RETRY_STATUSES
+            return response
+        finally:
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def close(self):
+        self.session.close()
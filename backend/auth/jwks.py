@@ -0,0 +1,181 @@
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+from jose import jwk
+
+logger = logging.getLogger(__name__)
+
+
+## JWKS Key Store
+'''
+JWKSKeyStore
+Keeps the parsed signing keys of a JSON Web Key Set in memory, indexed by kid
+
+it should fetch the key set lazily on first use
+it should serve keys from memory until the ttl expires
+it should keep serving the last good keys (stale-while-revalidate) while a
+    refresh is in flight or the key set endpoint is unreachable
+it should refetch at most once per min_refetch_interval when an unknown kid
+    arrives, so key rotation is picked up without hammering the endpoint
+it can refresh in a background thread so requests never wait on the network
+'''
+
+
+class JWKSUnavailableError(Exception):
+    pass
+
+
+class JWKSKeyStore:
+    def __init__(self, url, ttl=600, min_refetch_interval=30, timeout=5,
+                 background_refresh=False, default_algorithm='RS256'):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.background_refresh = background_refresh
+        self.default_algorithm = default_algorithm
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._thread = None
+        self._stop = threading.Event()
+        self.fetch_count = 0
+
+    def _fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key or key.get('kty') != 'RSA':
+                continue
+            if key.get('use', 'sig') != 'sig':
+                continue
+            keys[key['kid']] = jwk.construct(
+                key, key.get('alg', self.default_algorithm)
+            )
+        return keys
+
+    def refresh(self):
+        '''
+        Fetches the key set and swaps it in. On failure the previous keys are
+        kept and the error is re-raised to the caller.
+        '''
+        self._last_attempt = time.monotonic()
+        try:
+            keys = self._fetch()
+        finally:
+            self.fetch_count += 1
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return keys
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning('JWKS refresh from %s failed: %s', self.url, e)
+        finally:
+            self._refreshing = False
+
+    def _revalidate_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _is_stale(self, now):
+        return self._fetched_at is None or now - self._fetched_at >= self.ttl
+
+    def _can_refetch(self, now):
+        return (self._last_attempt is None
+                or now - self._last_attempt >= self.min_refetch_interval)
+
+    def get_key(self, kid):
+        '''
+        @INPUTS
+            kid: key id from the unverified token header
+
+        return the parsed key for kid, or None if the key set does not contain it
+        raise JWKSUnavailableError if no key set has ever been fetched and the
+            endpoint cannot be reached
+        '''
+        now = time.monotonic()
+        if self._fetched_at is None:
+            self._load()
+        elif self._is_stale(now) and not self.background_refresh \
+                and self._can_refetch(now):
+            # while the endpoint is down, at most one attempt per
+            # min_refetch_interval, the stale keys are served meanwhile
+            self._revalidate_async()
+        if self.background_refresh:
+            self.start()
+
+        key = self._keys.get(kid)
+        if key is None:
+            with self._fetch_lock:
+                key = self._keys.get(kid)
+                if key is None and self._can_refetch(time.monotonic()):
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logger.warning('JWKS refetch for kid %s failed: %s', kid, e)
+                    key = self._keys.get(kid)
+        return key
+
+    def _load(self):
+        with self._fetch_lock:
+            if self._fetched_at is not None:
+                return
+            # requests queued behind a failed cold start fail fast instead of
+            # each waiting for another timeout
+            if not self._can_refetch(time.monotonic()):
+                raise JWKSUnavailableError(
+                    f'JWKS fetch from {self.url} failed less than '
+                    f'{self.min_refetch_interval}s ago')
+            try:
+                self.refresh()
+            except Exception as e:
+                raise JWKSUnavailableError(e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._fetched_at is None:
+                wait = 0
+            else:
+                wait = max(self._fetched_at + self.ttl - time.monotonic(), 0)
+            if self._stop.wait(wait):
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning('JWKS refresh from %s failed: %s', self.url, e)
+                self._stop.wait(self.min_refetch_interval)
+
+    def start(self):
+        '''
+        Starts the background refresh thread. Safe to call repeatedly and after
+        a fork, where the parent's thread no longer exists.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout)
+        self._thread = None
@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import rsa
+from jose import jwk, jwt
+
+
+## Local JWKS stand-in
+'''
+Helpers for exercising the auth module without Auth0
+
+LocalJWKSServer serves a JSON Web Key Set over http on 127.0.0.1 and counts
+how often it is fetched. Keys can be added, rotated or the server taken
+"offline" while it is running. LocalTokenServer does the same for the token
+endpoint used by /login.
+'''
+
+
+def generate_signing_key(kid, bits=2048):
+    (public_key, private_key) = rsa.newkeys(bits)
+    pem = private_key.save_pkcs1().decode()
+    public_jwk = jwk.construct(pem, 'RS256').public_key().to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig'})
+    return {'kid': kid, 'pem': pem, 'jwk': public_jwk}
+
+
+def mint_token(signing_key, claims, domain, audience, expires_in=3600):
+    now = int(time.time())
+    payload = {
+        'iss': f'https://{domain}/',
+        'aud': audience,
+        'iat': now,
+        'exp': now + expires_in,
+    }
+    payload.update(claims)
+    return jwt.encode(
+        payload,
+        signing_key['pem'],
+        algorithm='RS256',
+        headers={'kid': signing_key['kid']}
+    )
+
+
+class LocalJWKSServer:
+    def __init__(self, keys=()):
+        self.keys = [key['jwk'] for key in keys]
+        self.available = True
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                if not server.available:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps({'keys': server.keys}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class LocalTokenServer:
+    '''
+    Stand-in for the Auth0 token endpoint, answering with the next status of
+    statuses (200 once they run out), over keep-alive connections
+    '''
+    def __init__(self, statuses=(), delay=0, retry_after=None):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.retry_after = retry_after
+        self.hits = 0
+        self.connections = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_POST(self):
+                server.hits += 1
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if server.delay:
+                    time.sleep(server.delay)
+                status = server.statuses.pop(0) if server.statuses else 200
+                body = json.dumps(
+                    {'access_token': 'token', 'expires_in': 86400} if status == 200
+                    else {'error': 'access_denied'}
+                ).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status != 200 and server.retry_after is not None:
+                    self.send_header('Retry-After', str(server.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}/oauth/token'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
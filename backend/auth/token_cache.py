@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+## Verified Token Cache
+'''
+TokenCache
+A bounded LRU cache of decoded JWT payloads, keyed by a sha256 of the token
+
+it should only hold payloads whose signature and claims were already verified
+it should drop an entry once the token's exp has passed
+it should evict the least recently used entry when maxsize is reached
+it should count hits, misses and evictions so the hit ratio can be monitored,
+    in stats() for this process and through on_event (the Prometheus
+    auth_token_cache_events_total counter, see metrics/metrics.py) for every
+    worker
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=1024, on_event=None):
+        self.maxsize = maxsize
+        self.on_event = on_event
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        if self.maxsize <= 0:
+            return None
+        key = self._key(token)
+        payload = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    del self._entries[key]
+                    payload = None
+            if payload is None:
+                self.misses += 1
+        self._event('miss' if payload is None else 'hit')
+        return payload
+
+    # called after the lock is released, a slow on_event must not serialize
+    # the token lookups
+    def _event(self, event, count=1):
+        if self.on_event is not None:
+            for _ in range(count):
+                self.on_event(event)
+
+    def set(self, token, payload):
+        if self.maxsize <= 0 or 'exp' not in payload:
+            return
+        expires_at = payload['exp']
+        if time.time() >= expires_at:
+            return
+        key = self._key(token)
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        self._event('eviction', evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,73 @@
+import os
+from unittest import mock
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from backend.auth import auth
+from backend.auth.auth import (
+    VerifiedPayload, check_permissions, compile_permissions, verify_decode_jwt
+)
+from backend.auth.jwks import JWKSKeyStore
+from backend.auth.testing import LocalJWKSServer, generate_signing_key, mint_token
+
+
+## Auth Benchmarks
+'''
+verify_decode_jwt: an RS256 token minted locally, checked against a stub JWKS
+    served on 127.0.0.1; the key set is fetched once, before measuring, so
+    this is the cost of a token cache miss: header parsing, RSA signature
+    and claims verification
+check_permissions: a verified payload against a single permission and a
+    compiled all_of/any_of requirement
+'''
+
+DOMAIN = 'casting-agency.test'
+AUDIENCE = 'casting-agency'
+PERMISSIONS = [
+    'get:movies', 'post:movies', 'patch:movies', 'delete:movies',
+    'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+    'post:casting'
+]
+
+
+@pytest.fixture(scope='module')
+def signing_key():
+    return generate_signing_key('bench-key', bits=2048)
+
+
+@pytest.fixture(scope='module')
+def jwks_store(signing_key):
+    server = LocalJWKSServer([signing_key]).start()
+    store = JWKSKeyStore(server.url)
+    patches = {
+        'jwks_store': store,
+        'AUTH0_DOMAIN': DOMAIN,
+        'API_AUDIENCE': AUDIENCE,
+        'ALGORITHMS': ['RS256'],
+    }
+    with mock.patch.multiple(auth, **patches):
+        yield store
+    store.stop()
+    server.stop()
+
+
+def test_verify_decode_jwt(benchmark, signing_key, jwks_store):
+    token = mint_token(signing_key, {'permissions': PERMISSIONS}, DOMAIN, AUDIENCE)
+    verify_decode_jwt(token)
+
+    payload = benchmark(verify_decode_jwt, token)
+
+    assert payload['permissions'] == PERMISSIONS
+    assert jwks_store.fetch_count == 1
+
+
+@pytest.mark.parametrize('permission', [
+    'get:movies',
+    compile_permissions(all_of=['get:movies', 'get:actors'], any_of=['post:casting', 'patch:movies'])
+], ids=['single', 'all_of+any_of'])
+def test_check_permissions(benchmark, permission):
+    payload = VerifiedPayload({'permissions': PERMISSIONS})
+
+    assert benchmark(check_permissions, permission, payload)
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import insert
+from backend.app import create_app
+from backend.auth import auth
+from backend.auth.auth import VerifiedPayload
+from backend.cache.cache import response_cache
+from backend.database.models import db, Movie, Actor, Casting
+
+
+## List Benchmarks
+'''
+readAllMovie / readAllActor: GET /movies and GET /actors with
+    ?paginate=false over in-memory SQLite seeded with 1k, 10k and 100k movies
+    and actors (one casting each), from the query to the serialized body;
+    auth is stubbed and the response cache is off so every round runs the
+    query
+Movie.format() / Actor.format(): one call on a loaded row
+'''
+
+SIZES = [1000, 10000, 100000]
+HEADERS = {'Authorization': 'Bearer bench-token'}
+PERMISSIONS = ['get:movies', 'get:actors']
+
+
+def seed(rows):
+    db.session.execute(insert(Movie), [
+        {'id': i, 'title': f'Movie {i}', 'release_date': datetime(2000 + i % 20, 1 + i % 12, 1 + i % 28)}
+        for i in range(1, rows + 1)
+    ])
+    db.session.execute(insert(Actor), [
+        {'id': i, 'name': f'Actor {i}', 'age': 20 + i % 50, 'gender': 'female' if i % 2 else 'male'}
+        for i in range(1, rows + 1)
+    ])
+    db.session.execute(insert(Casting), [
+        {'movie_id': i, 'actor_id': i} for i in range(1, rows + 1)
+    ])
+    db.session.commit()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def stub_auth():
+    payload = VerifiedPayload({'permissions': PERMISSIONS})
+    with mock.patch.object(auth, 'verify_decode_jwt', return_value=payload), \
+            mock.patch.object(response_cache, 'enabled', False):
+        yield
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=lambda rows: f'{rows}_rows')
+def dataset(request):
+    app = create_app({'database_path': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        seed(request.param)
+    yield app.test_client(), request.param
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.mark.parametrize('path', ['/movies', '/actors'])
+def test_read_all(benchmark, dataset, path):
+    client, rows = dataset
+
+    res = benchmark(client.get, f'{path}?paginate=false', headers=HEADERS)
+
+    assert res.status_code == 200
+    assert len(res.get_json()['data']) == rows
+
+
+@pytest.fixture(scope='module')
+def loaded():
+    app = create_app({'database_path': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        seed(1)
+        yield db.session.get(Movie, 1), db.session.get(Actor, 1)
+        db.drop_all()
+
+
+def test_movie_format(benchmark, loaded):
+    movie, _ = loaded
+    assert benchmark(movie.format)['id'] == 1
+
+
+def test_actor_format(benchmark, loaded):
+    _, actor = loaded
+    assert benchmark(actor.format)['id'] == 1
@@ -0,0 +1,85 @@
+import argparse
+import os
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from ..database.models import Movie
+from ..json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+
+
+## JSON Serialization Benchmark
+'''
+Per-row cost of building and serializing a /movies list
+
+    python -m backend.benchmarks.json_serialization --rows 10000
+
+strftime + Flask: the previous path, release_date formatted with strftime in
+    Movie.format() and the list dumped by Flask's default provider
+date + stdlib: Movie.format() as it is now and StdlibJSONProvider
+date + orjson: Movie.format() as it is now and OrjsonProvider
+'''
+
+
+def _legacy_format(movie):
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'release_date': movie.release_date.strftime("%Y-%m-%d") if movie.release_date else None
+    }
+
+
+def _movies(rows):
+    return [
+        Movie(id=i, title=f'Movie {i}', release_date=datetime(2000 + i % 20, 1 + i % 12, 1 + i % 28))
+        for i in range(rows)
+    ]
+
+
+def _actors(i):
+    return [{"id": i * 3 + a, "name": f"Actor {i * 3 + a}"} for a in range(3)]
+
+
+def _measure(movies, format, provider, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = []
+        for i, movie in enumerate(movies):
+            row = format(movie)
+            row["actors"] = _actors(i)
+            data.append(row)
+        body = provider.response({"success": True, "data": data}).get_data()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def run(rows=10000, repeat=5):
+    app = Flask(__name__)
+    paths = [
+        ('strftime + Flask', _legacy_format, DefaultJSONProvider(app)),
+        ('date + stdlib', Movie.format, StdlibJSONProvider(app)),
+    ]
+    if orjson is not None:
+        paths.append(('date + orjson', Movie.format, OrjsonProvider(app)))
+
+    movies = _movies(rows)
+    results = {}
+    with app.app_context():
+        for name, format, provider in paths:
+            seconds, size = _measure(movies, format, provider, repeat)
+            results[name] = seconds
+            print(f'{name:18} {seconds / rows * 1e6:8.2f} us/row  {size:,} bytes')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare JSON serialization paths of /movies.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
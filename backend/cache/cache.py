@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from ..database.versions import VERSIONED_TABLES, on_commit, read_versions
+
+logger = logging.getLogger(__name__)
+
+
+## Response Cache
+'''
+ResponseCache
+Caches the serialized bytes of list responses, keyed by endpoint namespace
+and normalized query string
+
+it should never be consulted before requires_auth has checked permissions
+it should drop a namespace as soon as a transaction that changed one of its
+    tables commits (see WRITE_DEPENDENCIES and database/versions.py)
+it should treat backend errors as misses, a cache outage never fails a request
+it should store entries in a pluggable backend: an in-process LRU by default
+    or any Redis-compatible client shared by every worker
+
+Invalidation bumps a per-namespace version that is part of every entry key,
+so old entries are never read again and simply age out of the backend.
+With the in-process backend each gunicorn worker has its own versions, a write
+handled by one worker does not invalidate the others. The app also keys every
+entry by the list's ETag (read from the database), so those workers miss
+instead of serving an old body; their old entries just take memory until they
+are evicted. The Redis backend shares one cache between every worker.
+'''
+
+# (table, operation) -> namespaces whose responses it changes
+#   a new movie or actor shows up in its own list only, an updated or deleted
+#   one also changes the titles/names embedded in the other list
+WRITE_DEPENDENCIES = {
+    ('Movie', 'insert'): ('movies',),
+    ('Movie', 'update'): ('movies', 'actors'),
+    ('Movie', 'delete'): ('movies', 'actors'),
+    ('Actor', 'insert'): ('actors',),
+    ('Actor', 'update'): ('actors', 'movies'),
+    ('Actor', 'delete'): ('actors', 'movies'),
+    ('Casting', 'insert'): ('movies', 'actors'),
+    ('Casting', 'update'): ('movies', 'actors'),
+    ('Casting', 'delete'): ('movies', 'actors'),
+}
+
+
+class LRUBackend:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = None if not ttl else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def incr_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class RedisBackend:
+    def __init__(self, client, prefix='casting-agency:response:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        # redis is optional, only needed when RESPONSE_CACHE=redis
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl or None)
+
+    def get_version(self, namespace):
+        return int(self.client.get(self.prefix + 'version:' + namespace) or 0)
+
+    def incr_version(self, namespace):
+        return self.client.incr(self.prefix + 'version:' + namespace)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=60, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    '''
+    @INPUTS
+        namespace: 'movies' or 'actors'
+        args: request.args
+
+    return the entry key, or None when caching is disabled
+    the namespace version is read here, before the response is built, so a
+    write committed meanwhile makes the entry unreachable instead of stale
+    '''
+    def key(self, namespace, args):
+        if not self.enabled:
+            return None
+        query = urlencode(sorted(args.items(multi=True)))
+        try:
+            version = self.backend.get_version(namespace)
+        except Exception as e:
+            logger.warning('response cache unavailable: %s', e)
+            return None
+        return f'{namespace}:{version}:{query}'
+
+    def get(self, key):
+        if key is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning('response cache unavailable: %s', e)
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning('response cache unavailable: %s', e)
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            try:
+                self.backend.incr_version(namespace)
+            except Exception as e:
+                logger.error('could not invalidate %s responses: %s', namespace, e)
+            self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+def backend_from_env():
+    kind = os.getenv("RESPONSE_CACHE", "memory").lower()
+    if kind == "redis":
+        return RedisBackend.from_url(os.getenv("RESPONSE_CACHE_URL", os.getenv("REDIS_URL")))
+    return LRUBackend(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 256)))
+
+
+response_cache = ResponseCache(
+    backend_from_env(),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL", 60)),
+    enabled=os.getenv("RESPONSE_CACHE", "memory").lower() != "off"
+)
+
+
+#  ----------------------------------------------------------------
+#  Invalidation
+#  ----------------------------------------------------------------
+
+@on_commit
+def _invalidate_on_commit(writes):
+    namespaces = set()
+    for write in writes:
+        namespaces.update(WRITE_DEPENDENCIES.get(write, ()))
+    if namespaces:
+        response_cache.invalidate(*sorted(namespaces))
+
+
+#  ----------------------------------------------------------------
+#  ETags
+#  ----------------------------------------------------------------
+
+# Bump when the serialized shape of the lists changes, so clients holding an
+# ETag from an older release do not get a 304
+RESPONSE_FORMAT_VERSION = 1
+
+'''
+@INPUTS
+    namespace: 'movies' or 'actors'
+    args: request.args
+
+return a strong ETag (without quotes) for the list response
+both lists embed rows of all three tables, so all table versions are part of it
+'''
+
+
+def list_etag(namespace, args):
+    versions = read_versions()
+    state = '|'.join([
+        namespace,
+        str(RESPONSE_FORMAT_VERSION),
+        ','.join(f'{table}:{versions[table]}' for table in VERSIONED_TABLES),
+        urlencode(sorted(args.items(multi=True)))
+    ])
+    return hashlib.sha1(state.encode()).hexdigest()
@@ -0,0 +1,182 @@
+import mimetypes
+import os
+import zlib
+import brotli
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+
+## Response Compression
+'''
+Content-negotiated compression of API responses and precompressed static files
+
+it should brotli or gzip compressible responses of at least
+    COMPRESS_MIN_SIZE bytes, as the client prefers
+it should compress streamed responses chunk by chunk, flushing after every
+    chunk so the client still receives them as they are produced
+it should leave alone responses that are already encoded, files and
+    responses to HEAD, ranges, 204 and 304
+it should serve the .br/.gz siblings written next to the frontend bundle at
+    build time (frontend/precompress.js) instead of compressing static files
+    per request
+'''
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+COMPRESSIBLE_MIMETYPES = (
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'image/svg+xml'
+)
+# static file suffix of each precompressed encoding, by preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(
+            COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+COMPRESSORS = {'br': _Brotli, 'gzip': _Gzip}
+
+
+def compress(data, encoding):
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    compressor = COMPRESSORS[encoding]()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+'''
+return the encoding the client prefers among those offered, None for identity
+'''
+
+
+def negotiate(offered):
+    best = None
+    best_quality = 0
+    for encoding in offered:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+'''
+return the strong ETag of the encoding's representation of a response
+tagged etag; RFC 7232 asks for a different strong ETag per encoding
+'''
+
+
+def encoded_etag(etag, encoding):
+    return f'{etag}-{encoding}'
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def compress_response(response):
+    if request.method == 'HEAD' or 'Range' in request.headers \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or not _compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(COMPRESSORS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+
+    # another representation than the identity one, with its own strong ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+'''
+@INPUTS
+    static_folder: the app's static folder
+    filename: path of the requested file in it
+
+return the precompressed sibling of filename the client accepts, or None
+'''
+
+
+def send_precompressed(static_folder, filename):
+    accepted = [
+        (encoding, suffix) for encoding, suffix in PRECOMPRESSED
+        if request.accept_encodings[encoding] > 0
+    ]
+    for encoding, suffix in accepted:
+        path = safe_join(static_folder, filename + suffix)
+        if path is None or not os.path.isfile(path):
+            continue
+        response = send_from_directory(
+            static_folder, filename + suffix,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    return None
+
+
+def init_compression(app):
+    app.after_request(compress_response)
+
+    serve_static = app.view_functions['static']
+
+    def static(filename):
+        response = send_precompressed(app.static_folder, filename)
+        if response is None:
+            response = serve_static(filename=filename)
+        return response
+
+    app.view_functions['static'] = static
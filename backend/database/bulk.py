@@ -0,0 +1,167 @@
+from datetime import datetime
+from sqlalchemy import insert, tuple_
+from .models import db, Movie, Actor, Casting
+
+
+## Bulk Create
+'''
+Validation and insertion for the bulk create endpoints
+
+Every item is validated before anything is written. Validators return
+(rows, errors): rows ready for insert and a list of
+{"index": position in the request, "errors": {field: message}}.
+Rows are inserted with a single executemany INSERT ... RETURNING id
+(batched multi-row inserts on PostgreSQL and SQLite) in the caller's
+transaction.
+'''
+
+
+def _required_string(item, field, errors, max_length=None):
+    value = item.get(field)
+    if not isinstance(value, str) or not value.strip():
+        errors[field] = 'is required'
+    elif max_length is not None and len(value) > max_length:
+        errors[field] = f'must be at most {max_length} characters'
+    return value
+
+
+def _integer(item, field, errors):
+    '''
+    accepts JSON integers, integral floats (1.0) and integer strings (the CSV
+    import); 1.9 or "1.9" is an error, never truncated
+    '''
+    value = item.get(field)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    errors[field] = 'must be an integer'
+
+
+def _collect(items, validate):
+    '''
+    return ([(index, row)] of the valid items, errors)
+    '''
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array.')
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        item_errors = {}
+        if isinstance(item, dict):
+            row = validate(item, item_errors)
+        else:
+            item_errors['item'] = 'must be an object'
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            rows.append((index, row))
+    return rows, errors
+
+
+def _movie(item, errors):
+    title = _required_string(item, 'title', errors)
+    release_date = item.get('release_date')
+    if release_date is not None:
+        try:
+            release_date = datetime.strptime(release_date, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            errors['release_date'] = 'must be a YYYY-MM-DD date'
+    return {"title": title, "release_date": release_date}
+
+
+def _actor(item, errors):
+    return {
+        "name": _required_string(item, 'name', errors, max_length=120),
+        "age": _integer(item, 'age', errors),
+        "gender": _required_string(item, 'gender', errors, max_length=50)
+    }
+
+
+def _casting(item, errors):
+    return {
+        "movie_id": _integer(item, 'movie', errors),
+        "actor_id": _integer(item, 'actor', errors)
+    }
+
+
+def validate_movies(items):
+    rows, errors = _collect(items, _movie)
+    return [row for _, row in rows], errors
+
+
+def validate_actors(items):
+    rows, errors = _collect(items, _actor)
+    return [row for _, row in rows], errors
+
+
+'''
+@INPUTS
+    items: [{"movie": id, "actor": id}, ...]
+
+besides the shape of each item, checks in three statements however many
+pairs there are that every movie and actor exists and that no pair is
+already cast or repeated in the request
+'''
+
+
+def validate_castings(items):
+    rows, errors = _collect(items, _casting)
+    if not rows:
+        return [], errors
+
+    movie_ids = {row["movie_id"] for _, row in rows}
+    actor_ids = {row["actor_id"] for _, row in rows}
+    pairs = {(row["movie_id"], row["actor_id"]) for _, row in rows}
+    found_movies = set(db.session.execute(
+        db.select(Movie.id).where(Movie.id.in_(movie_ids))
+    ).scalars())
+    found_actors = set(db.session.execute(
+        db.select(Actor.id).where(Actor.id.in_(actor_ids))
+    ).scalars())
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(Casting.movie_id, Casting.actor_id)
+        .where(tuple_(Casting.movie_id, Casting.actor_id).in_(pairs))
+    )}
+
+    valid = []
+    seen = set()
+    for index, row in rows:
+        item_errors = {}
+        pair = (row["movie_id"], row["actor_id"])
+        if row["movie_id"] not in found_movies:
+            item_errors["movie"] = 'not found'
+        if row["actor_id"] not in found_actors:
+            item_errors["actor"] = 'not found'
+        if pair in existing or pair in seen:
+            item_errors["actor"] = 'is already cast in this movie'
+        seen.add(pair)
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            valid.append(row)
+    errors.sort(key=lambda error: error["index"])
+    return valid, errors
+
+
+'''
+@INPUTS
+    model: Movie, Actor or Casting
+    rows: validated rows
+
+return the ids of the inserted rows, in the order of rows
+'''
+
+
+def bulk_insert(model, rows):
+    if not rows:
+        return []
+    return list(db.session.scalars(
+        insert(model).returning(model.id, sort_by_parameter_order=True),
+        rows
+    ))
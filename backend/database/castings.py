@@ -0,0 +1,131 @@
+from sqlalchemy import delete, exists, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.exc import NoResultFound
+from .models import db, Movie, Actor, Casting
+
+
+## Set-Based Casting Writes
+'''
+Adding a casting and replacing a movie's cast each run a constant number of
+statements, whatever the size of the cast: existence and uniqueness are
+checked by the database in the same statement that writes, instead of loading
+the movie and the actor first.
+'''
+
+
+class CastingExists(Exception):
+    pass
+
+
+class UnknownActors(Exception):
+    def __init__(self, actor_ids):
+        super().__init__(f'unknown actors: {actor_ids}')
+        self.actor_ids = actor_ids
+
+
+'''
+return an INSERT for Casting
+the SELECTs it is fed filter out pairs already cast (_not_cast), ON CONFLICT
+DO NOTHING also skips a pair committed concurrently on PostgreSQL and SQLite,
+elsewhere that race ends in an IntegrityError
+'''
+
+
+def _insert_casting():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(Casting).on_conflict_do_nothing(
+            index_elements=['movie_id', 'actor_id'])
+    if dialect == 'sqlite':
+        return sqlite.insert(Casting).on_conflict_do_nothing(
+            index_elements=['movie_id', 'actor_id'])
+    return insert(Casting)
+
+
+def _not_cast(movie_id, actor_id):
+    return ~exists().where(Casting.movie_id == movie_id, Casting.actor_id == actor_id)
+
+
+'''
+@INPUTS
+    movie_id, actor_id: ids from the request
+
+it should add the pair in one INSERT ... SELECT that only yields a row when
+    both the movie and the actor exist and the pair is not cast yet
+it should raise NoResultFound when the movie or the actor does not exist
+it should raise CastingExists when the actor is already cast in the movie
+return the id of the new casting
+'''
+
+
+def add_casting(movie_id, actor_id):
+    pair = db.select(Movie.id, Actor.id) \
+        .select_from(Movie) \
+        .join(Actor, Actor.id == actor_id) \
+        .where(Movie.id == movie_id, _not_cast(Movie.id, Actor.id))
+    casting_id = db.session.execute(
+        _insert_casting()
+        .from_select(['movie_id', 'actor_id'], pair)
+        .returning(Casting.id)
+    ).scalar()
+    if casting_id is not None:
+        return casting_id
+
+    # nothing inserted, only now find out why
+    movie_found, actor_found = db.session.execute(db.select(
+        db.select(Movie.id).where(Movie.id == movie_id).exists(),
+        db.select(Actor.id).where(Actor.id == actor_id).exists()
+    )).one()
+    if not (movie_found and actor_found):
+        raise NoResultFound()
+    raise CastingExists()
+
+
+'''
+@INPUTS
+    movie_id: id of the movie
+    actor_ids: the complete new cast
+
+it should lock the movie row, so concurrent replacements apply one after
+    the other
+it should remove the actors not in actor_ids and add the missing ones with
+    one DELETE and one INSERT ... SELECT, keeping the castings that stay
+it should raise NoResultFound for an unknown movie and UnknownActors when
+    some of actor_ids do not exist, before writing anything
+return (added actor ids, removed actor ids), both sorted
+'''
+
+
+def replace_cast(movie_id, actor_ids):
+    actor_ids = set(actor_ids)
+    db.session.execute(
+        db.select(Movie.id).where(Movie.id == movie_id).with_for_update()
+    ).one()
+
+    if actor_ids:
+        found = set(db.session.execute(
+            db.select(Actor.id).where(Actor.id.in_(actor_ids))
+        ).scalars())
+        if found != actor_ids:
+            raise UnknownActors(sorted(actor_ids - found))
+
+    removed = db.session.execute(
+        delete(Casting)
+        .where(Casting.movie_id == movie_id, Casting.actor_id.not_in(actor_ids))
+        .returning(Casting.actor_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    added = []
+    if actor_ids:
+        cast = db.select(Movie.id, Actor.id) \
+            .select_from(Movie) \
+            .join(Actor, Actor.id.in_(actor_ids)) \
+            .where(Movie.id == movie_id, _not_cast(Movie.id, Actor.id))
+        added = db.session.execute(
+            _insert_casting()
+            .from_select(['movie_id', 'actor_id'], cast)
+            .returning(Casting.actor_id)
+        ).scalars().all()
+
+    return sorted(added), sorted(removed)
@@ -2,6 +2,9 @@ import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+from .pool import engine_options
+from .replicas import RoutingSession, init_replicas
+from .slow_queries import init_slow_query_log
 
 load_dotenv()
 
@@ -17,15 +20,24 @@ database_path = "{}://{}:{}@{}:{}/{}".format(
 database_path = os.environ['DATABASE_URL']
 if database_path.startswith("postgres://"):
     database_path = database_path.replace("postgres://", "postgresql://", 1)
+# Read replicas, comma separated
+replica_paths = [
+    path.strip().replace("postgres://", "postgresql://", 1)
+    for path in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if path.strip()
+]
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    init_replicas(app, replica_paths)
     db.app = app
     db.init_app(app)
+    init_slow_query_log(app, db)
     Migrate(app, db)
 
 
@@ -35,6 +47,7 @@ class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
     release_date = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
 
     casting = db.relationship('Casting', backref='movie', lazy='joined', cascade="all, delete")
 
@@ -45,7 +58,8 @@ class Movie(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'release_date': self.release_date.strftime("%Y-%m-%d")
+            # a date, serialized as "YYYY-MM-DD" by the app's JSON provider
+            'release_date': self.release_date.date() if self.release_date else None
         }
 
 
@@ -56,6 +70,7 @@ class Actor(db.Model):
     name = db.Column(db.String(120), nullable=False)
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.String(50), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
 
     casting = db.relationship('Casting', backref='actor', lazy='joined', cascade="all, delete")
 
@@ -73,10 +88,17 @@ class Actor(db.Model):
 
 class Casting(db.Model):
     __tablename__ = 'Casting'
+    # The unique (movie_id, actor_id) index also serves lookups by movie_id,
+    # actor_id gets its own index (migration 7d2b9e41c6a8)
+    __table_args__ = (
+        db.UniqueConstraint('movie_id', 'actor_id', name='uq_Casting_movie_id_actor_id'),
+        db.Index('ix_Casting_actor_id', 'actor_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     movie_id = db.Column(db.Integer, db.ForeignKey('Movie.id'), nullable=False)
     actor_id = db.Column(db.Integer, db.ForeignKey('Actor.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
 
     def __repr__(self):
         return f"Casting(id={self.id}, movie_id={self.movie_id}, actor_id={self.actor_id})"
@@ -87,3 +109,42 @@ class Casting(db.Model):
             'movie_id': self.movie_id,
             'actor_id': self.actor_id
         }
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"TableVersion(table_name={self.table_name}, version={self.version})"
+
+
+#  ----------------------------------------------------------------
+#  List filter and sort indexes (migration 5c1e7a3f2d90)
+#  ----------------------------------------------------------------
+
+# title/name prefix filters: lower(column) LIKE 'abc%'
+# title/name substring filters: lower(column) LIKE '%abc%' (pg_trgm)
+# keyset pages sorted by (column, id)
+db.Index('ix_Movie_title_lower_pattern',
+         db.func.lower(Movie.__table__.c.title).label('title_lower'),
+         postgresql_ops={'title_lower': 'text_pattern_ops'})
+db.Index('ix_Movie_title_trgm',
+         db.func.lower(Movie.__table__.c.title).label('title_lower'),
+         postgresql_using='gin',
+         postgresql_ops={'title_lower': 'gin_trgm_ops'})
+db.Index('ix_Movie_title_id', Movie.title, Movie.id)
+db.Index('ix_Movie_release_date_id', Movie.release_date, Movie.id)
+
+db.Index('ix_Actor_name_lower_pattern',
+         db.func.lower(Actor.__table__.c.name).label('name_lower'),
+         postgresql_ops={'name_lower': 'text_pattern_ops'})
+db.Index('ix_Actor_name_trgm',
+         db.func.lower(Actor.__table__.c.name).label('name_lower'),
+         postgresql_using='gin',
+         postgresql_ops={'name_lower': 'gin_trgm_ops'})
+db.Index('ix_Actor_name_id', Actor.name, Actor.id)
+db.Index('ix_Actor_age_id', Actor.age, Actor.id)
+db.Index('ix_Actor_gender', Actor.gender)
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+## Connection Pool
+'''
+Engine options for setup_db, read from the environment
+
+it should ping connections before handing them out and recycle them after
+    DB_POOL_RECYCLE seconds, so a database failover costs one reconnect
+    instead of failed requests
+it should name its connections (application_name) and bound every statement
+    (statement_timeout) on PostgreSQL
+it should, with DB_PGBOUNCER, keep no connections of its own (NullPool) and
+    leave pooling to PgBouncer in transaction mode
+it should count checkouts, connects, invalidations and the time spent
+    waiting for a connection, per process
+'''
+
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "casting-agency")
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def observe_checkout(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds, 6),
+                'wait_seconds_avg': round(self.wait_seconds / attempts, 6) if attempts else 0.0,
+                'wait_seconds_max': round(self.max_wait_seconds, 6)
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class _TimedCheckout:
+    '''
+    Times every checkout, including waiting for a connection to be returned
+    and opening a new one
+    '''
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_metrics.observe_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.observe_checkout(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+for _pool_class in (TimedQueuePool, TimedNullPool):
+    event.listen(_pool_class, 'connect', lambda *args: pool_metrics.count('connects'))
+    event.listen(_pool_class, 'invalidate', lambda *args: pool_metrics.count('invalidations'))
+
+
+'''
+@INPUTS
+    database_path: the SQLALCHEMY_DATABASE_URI
+
+return SQLALCHEMY_ENGINE_OPTIONS
+SQLite is left to Flask-SQLAlchemy's defaults (in-memory databases need a
+single shared connection)
+'''
+
+
+def engine_options(database_path):
+    url = make_url(database_path)
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    if DB_PGBOUNCER:
+        options = {'poolclass': TimedNullPool}
+    else:
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': DB_POOL_PRE_PING
+        }
+
+    if url.get_backend_name() == 'postgresql':
+        connect_args = {'application_name': DB_APPLICATION_NAME}
+        if DB_STATEMENT_TIMEOUT and DB_PGBOUNCER:
+            # PgBouncer rejects startup options and a session SET would leak
+            # to other clients in transaction mode
+            logger.warning('DB_STATEMENT_TIMEOUT is ignored with DB_PGBOUNCER, '
+                           'set statement_timeout on the database role instead')
+        elif DB_STATEMENT_TIMEOUT:
+            connect_args['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+        options['connect_args'] = connect_args
+    return options
+
+
+'''
+return the pool metrics of this process and, for a QueuePool, its current
+size, checked out connections and overflow
+'''
+
+
+def pool_status(engine):
+    status = pool_metrics.stats()
+    pool = engine.pool
+    status['pool'] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow()
+        })
+    return status
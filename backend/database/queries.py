@@ -0,0 +1,503 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import lazyload
+from .models import db, Movie, Actor, Casting
+
+
+## List Queries
+'''
+Read paths for the list endpoints
+
+Both lists can be filtered, sorted by a whitelisted key and read whole or one
+keyset page at a time. A page is selected with
+WHERE (sort key, id) > (cursor values) ORDER BY sort key, id LIMIT n, so the
+cost of a page does not depend on how deep it is.
+'''
+
+MOVIE_SORT_KEYS = ('id', 'title', 'release_date')
+ACTOR_SORT_KEYS = ('id', 'name', 'age')
+
+# JSON type of the sort value stored in a cursor
+CURSOR_VALUE_TYPES = {
+    'title': str,
+    'name': str,
+    'age': int,
+    'release_date': str
+}
+
+# sort keys whose column can be NULL, the NULLs sort last
+NULLABLE_SORT_KEYS = ('release_date',)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+## Cursors
+'''
+A cursor is the url-safe base64 of {"s": sort key, "v": last row's key values}.
+Clients must treat it as opaque.
+'''
+
+
+def encode_cursor(sort, values):
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps({"s": sort, "v": values}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        values = data['v']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('Malformed cursor.')
+    if data.get('s') != sort or not isinstance(values, list):
+        raise InvalidCursor('Cursor does not match the requested sort.')
+    if len(values) != (1 if sort == 'id' else 2) \
+            or not isinstance(values[-1], int):
+        raise InvalidCursor('Malformed cursor.')
+    if values[0] is None and sort not in NULLABLE_SORT_KEYS:
+        raise InvalidCursor('Malformed cursor.')
+    if sort != 'id' and values[0] is not None:
+        if not isinstance(values[0], CURSOR_VALUE_TYPES[sort]):
+            raise InvalidCursor('Malformed cursor.')
+        if sort == 'release_date':
+            try:
+                values[0] = datetime.fromisoformat(values[0])
+            except ValueError:
+                raise InvalidCursor('Malformed cursor.')
+    return values
+
+
+'''
+@INPUTS
+    query: a Model.query or db.select() over model
+    model: Movie or Actor
+    sort: one of the model's sort keys
+    after: cursor of the previous page, or None
+
+return (queries ordered by (sort, id) and restricted to rows after the cursor,
+        function building the cursor of a result row)
+
+Every query is a single range on the (sort, id) index: WHERE (sort, id) >
+(cursor values), never an OR the planner cannot seek with. Rows without a
+release date sort last, so a release_date page that starts among the dated
+movies is read by two queries, the dated rows after the cursor, then the
+undated ones by id; run them in order with _fetch_page.
+'''
+
+
+def _order_by(model, sort):
+    if sort == 'id':
+        return [model.id]
+    return [getattr(model, sort).asc().nullslast(), model.id]
+
+
+def _keyset(query, model, sort, after):
+    if sort == 'id':
+        query = query.order_by(model.id)
+        if after is not None:
+            (id,) = decode_cursor(after, sort)
+            query = query.where(model.id > id)
+        return [query], lambda row: encode_cursor(sort, [row.id])
+
+    column = getattr(model, sort)
+    cursor_values = lambda row: encode_cursor(sort, [getattr(row, sort), row.id])
+    if after is None:
+        return [query.order_by(*_order_by(model, sort))], cursor_values
+
+    value, id = decode_cursor(after, sort)
+    if value is None:
+        return [query.where(column.is_(None), model.id > id).order_by(model.id)], cursor_values
+    queries = [query.where(tuple_(column, model.id) > (value, id)).order_by(column, model.id)]
+    if sort in NULLABLE_SORT_KEYS:
+        queries.append(query.where(column.is_(None)).order_by(model.id))
+    return queries, cursor_values
+
+
+'''
+@INPUTS
+    queries, cursor_values: as returned by _keyset
+    limit: page size, or None for every row
+    fetch: function running a query and returning its rows
+
+return (rows of the page, cursor of the next page or None)
+'''
+
+
+def _fetch_page(queries, limit, cursor_values, fetch):
+    rows = []
+    for query in queries:
+        if limit is not None:
+            query = query.limit(limit + 1 - len(rows))
+        rows += fetch(query)
+        if limit is not None and len(rows) > limit:
+            break
+    return _page(rows, limit, cursor_values)
+
+
+def _page(rows, limit, cursor_values):
+    '''
+    rows were fetched with limit + 1, the extra row only tells whether a next
+    page exists
+    '''
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, cursor_values(rows[-1])
+
+
+## Filters
+'''
+Filters are parsed from the request query string into the conditions below.
+Text filters match case-insensitively on lower(column), which is what the
+pattern and trigram indexes of migration 5c1e7a3f2d90 are built on.
+'''
+
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _text_filters(column, prefix, contains):
+    conditions = []
+    if prefix:
+        conditions.append(
+            func.lower(column).like(_like_escape(prefix.lower()) + '%', escape='\\')
+        )
+    if contains:
+        conditions.append(
+            func.lower(column).like('%' + _like_escape(contains.lower()) + '%', escape='\\')
+        )
+    return conditions
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer.')
+
+
+def _date_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f'{name} must be a YYYY-MM-DD date.')
+
+
+'''
+@INPUTS
+    args: request query string (request.args)
+
+supported filters:
+    title_prefix, title_contains
+    release_date_from, release_date_to: inclusive YYYY-MM-DD dates
+    actor: id of an actor who must be in the cast
+
+return a list of SQL conditions on Movie
+'''
+
+
+def movie_filters(args):
+    conditions = _text_filters(
+        Movie.title, args.get('title_prefix'), args.get('title_contains')
+    )
+    release_date_from = _date_arg(args, 'release_date_from')
+    if release_date_from is not None:
+        conditions.append(Movie.release_date >= release_date_from)
+    release_date_to = _date_arg(args, 'release_date_to')
+    if release_date_to is not None:
+        conditions.append(Movie.release_date < release_date_to + timedelta(days=1))
+    actor_id = _int_arg(args, 'actor')
+    if actor_id is not None:
+        conditions.append(Movie.id.in_(
+            db.select(Casting.movie_id).where(Casting.actor_id == actor_id)
+        ))
+    return conditions
+
+
+'''
+@INPUTS
+    args: request query string (request.args)
+
+supported filters:
+    name_prefix, name_contains
+    age_min, age_max: inclusive
+    gender
+    movie: id of a movie the actor must be cast in
+
+return a list of SQL conditions on Actor
+'''
+
+
+def actor_filters(args):
+    conditions = _text_filters(
+        Actor.name, args.get('name_prefix'), args.get('name_contains')
+    )
+    age_min = _int_arg(args, 'age_min')
+    if age_min is not None:
+        conditions.append(Actor.age >= age_min)
+    age_max = _int_arg(args, 'age_max')
+    if age_max is not None:
+        conditions.append(Actor.age <= age_max)
+    gender = args.get('gender')
+    if gender:
+        conditions.append(Actor.gender == gender)
+    movie_id = _int_arg(args, 'movie')
+    if movie_id is not None:
+        conditions.append(Actor.id.in_(
+            db.select(Casting.actor_id).where(Casting.movie_id == movie_id)
+        ))
+    return conditions
+
+
+## Movies
+'''
+@INPUTS
+    movie_ids: optional iterable of movie ids to restrict the lookup to
+
+return a dict mapping movie id to its [{"id", "name"}] actors, in casting order
+'''
+
+
+def actors_by_movie(movie_ids=None):
+    query = db.select(Casting.movie_id, Actor.id, Actor.name) \
+        .join(Actor, Casting.actor_id == Actor.id) \
+        .order_by(Casting.movie_id, Casting.id)
+    if movie_ids is not None:
+        query = query.where(Casting.movie_id.in_(movie_ids))
+
+    actors = {}
+    for movie_id, actor_id, name in db.session.execute(query):
+        actors.setdefault(movie_id, []).append({
+            "id": actor_id,
+            "name": name
+        })
+    return actors
+
+
+'''
+@INPUTS
+    limit: page size, or None for every movie
+    after: cursor returned as "next" by the previous page
+    sort: one of MOVIE_SORT_KEYS (movies without a release date come last)
+    filters: conditions from movie_filters
+
+return (movies formatted like Movie.format() plus their "actors", next cursor)
+in two statements, the page of movies then the cast of the movies kept on it
+(never of the lookahead row); a release_date page that reaches the undated
+movies reads them with one more
+'''
+
+
+def read_movies(limit=None, after=None, sort='id', filters=()):
+    if sort not in MOVIE_SORT_KEYS:
+        raise ValueError(f'Unknown sort key {sort}.')
+
+    query = Movie.query.options(lazyload(Movie.casting)).where(*filters)
+    queries, cursor_values = _keyset(query, Movie, sort, after)
+    results, next_cursor = _fetch_page(
+        queries, limit, cursor_values, lambda query: query.all()
+    )
+    if not results:
+        return [], next_cursor
+
+    if limit is None and not filters:
+        actors = actors_by_movie()
+    else:
+        actors = actors_by_movie([result.id for result in results])
+
+    movies = []
+    for result in results:
+        data = result.format()
+        data["actors"] = actors.get(result.id, [])
+        movies.append(data)
+    return movies, next_cursor
+
+
+## Actors
+'''
+@INPUTS
+    actor_ids: optional iterable of actor ids to restrict the lookup to
+
+return a dict mapping actor id to its [{"id", "title"}] movies, in casting order
+'''
+
+
+def movies_by_actor(actor_ids=None):
+    query = db.select(Casting.actor_id, Movie.id, Movie.title) \
+        .join(Movie, Casting.movie_id == Movie.id) \
+        .order_by(Casting.actor_id, Casting.id)
+    if actor_ids is not None:
+        query = query.where(Casting.actor_id.in_(actor_ids))
+
+    movies = {}
+    for actor_id, movie_id, title in db.session.execute(query):
+        movies.setdefault(actor_id, []).append({
+            "id": movie_id,
+            "title": title
+        })
+    return movies
+
+
+'''
+@INPUTS
+    limit: page size, or None for every actor
+    after: cursor returned as "next" by the previous page
+    sort: one of ACTOR_SORT_KEYS
+    filters: conditions from actor_filters
+
+return (actors formatted like Actor.format() plus their "movies", next cursor)
+selects only the needed columns and builds the dicts from the row tuples,
+in at most two statements
+'''
+
+
+def read_actors(limit=None, after=None, sort='id', filters=()):
+    if sort not in ACTOR_SORT_KEYS:
+        raise ValueError(f'Unknown sort key {sort}.')
+
+    query = db.select(Actor.id, Actor.name, Actor.age, Actor.gender) \
+        .where(*filters)
+    queries, cursor_values = _keyset(query, Actor, sort, after)
+    rows, next_cursor = _fetch_page(
+        queries, limit, cursor_values,
+        lambda query: db.session.execute(query).all()
+    )
+    if not rows:
+        return [], next_cursor
+
+    if limit is None and not filters:
+        movies = movies_by_actor()
+    else:
+        movies = movies_by_actor([row[0] for row in rows])
+    return [
+        {
+            "id": id,
+            "name": name,
+            "age": age,
+            "gender": gender,
+            "movies": movies.get(id, [])
+        }
+        for id, name, age, gender in rows
+    ], next_cursor
+
+
+## Streaming
+'''
+Generators for streamed list responses
+
+Each list is read with a single ordered outer join over a server-side cursor
+(yield_per sets stream_results), and consecutive rows of the same movie or
+actor are folded into one dict. Only one batch of rows and one row dict are
+held in memory, however long the list is.
+'''
+
+STREAM_BATCH_SIZE = 1000
+
+
+'''
+@INPUTS
+    sort: one of MOVIE_SORT_KEYS
+    filters: conditions from movie_filters
+    batch_size: rows fetched from the cursor at a time
+
+return a generator of movies in the same shape and order as read_movies
+'''
+
+
+def iter_movies(sort='id', filters=(), batch_size=STREAM_BATCH_SIZE):
+    if sort not in MOVIE_SORT_KEYS:
+        raise ValueError(f'Unknown sort key {sort}.')
+
+    query = db.select(
+        Movie.id, Movie.title, Movie.release_date, Casting.actor_id, Actor.name
+    ).outerjoin(Casting, Casting.movie_id == Movie.id) \
+        .outerjoin(Actor, Actor.id == Casting.actor_id) \
+        .where(*filters) \
+        .order_by(*_order_by(Movie, sort), Casting.id) \
+        .execution_options(yield_per=batch_size)
+
+    # the query is built and validated here, rows are only read when the
+    # response body is iterated
+    def movies():
+        movie = None
+        for id, title, release_date, actor_id, name in db.session.execute(query):
+            if movie is None or movie["id"] != id:
+                if movie is not None:
+                    yield movie
+                movie = {
+                    "id": id,
+                    "title": title,
+                    "release_date": release_date.date() if release_date else None,
+                    "actors": []
+                }
+            if actor_id is not None:
+                movie["actors"].append({
+                    "id": actor_id,
+                    "name": name
+                })
+        if movie is not None:
+            yield movie
+
+    return movies()
+
+
+'''
+@INPUTS
+    sort: one of ACTOR_SORT_KEYS
+    filters: conditions from actor_filters
+    batch_size: rows fetched from the cursor at a time
+
+return a generator of actors in the same shape and order as read_actors
+'''
+
+
+def iter_actors(sort='id', filters=(), batch_size=STREAM_BATCH_SIZE):
+    if sort not in ACTOR_SORT_KEYS:
+        raise ValueError(f'Unknown sort key {sort}.')
+
+    query = db.select(
+        Actor.id, Actor.name, Actor.age, Actor.gender, Casting.movie_id, Movie.title
+    ).outerjoin(Casting, Casting.actor_id == Actor.id) \
+        .outerjoin(Movie, Movie.id == Casting.movie_id) \
+        .where(*filters) \
+        .order_by(*_order_by(Actor, sort), Casting.id) \
+        .execution_options(yield_per=batch_size)
+
+    def actors():
+        actor = None
+        for id, name, age, gender, movie_id, title in db.session.execute(query):
+            if actor is None or actor["id"] != id:
+                if actor is not None:
+                    yield actor
+                actor = {
+                    "id": id,
+                    "name": name,
+                    "age": age,
+                    "gender": gender,
+                    "movies": []
+                }
+            if movie_id is not None:
+                actor["movies"].append({
+                    "id": movie_id,
+                    "title": title
+                })
+        if actor is not None:
+            yield actor
+
+    return actors()
@@ -0,0 +1,180 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from .pool import engine_options
+
+logger = logging.getLogger(__name__)
+
+
+## Read Replicas
+'''
+Optional read replicas, given to setup_db as a list of URLs
+
+it should send the queries of handlers decorated with @read_only to a replica,
+    round robin, skipping replicas whose last health check failed
+it should send everything else, and any write or flush, to the primary
+it should fall back to the primary when no replica is healthy
+it should read from the primary for DB_READ_PRIMARY_SECONDS after a client
+    wrote (cookie set on the write response), or when the request sends
+    X-Read-Primary: true, so clients read their own writes despite
+    replication lag
+'''
+
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", 10))
+# the health checks connect on the request path, an unreachable replica must
+# fail fast instead of after the OS TCP timeout
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", 2))
+DB_READ_PRIMARY_SECONDS = int(os.getenv("DB_READ_PRIMARY_SECONDS", 5))
+READ_PRIMARY_COOKIE = 'read_primary'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(Session):
+    '''
+    Uses the replica chosen for the request (session.info['replica']) for
+    reads, the binds configured on the models otherwise
+    '''
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and not self._flushing \
+                and not getattr(clause, 'is_dml', False):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaSet:
+    def __init__(self, engines, health_interval=DB_REPLICA_HEALTH_INTERVAL):
+        self.engines = dict(engines)
+        self.keys = list(self.engines)
+        self.health_interval = health_interval
+        self._healthy = dict.fromkeys(self.keys, True)
+        self._next_check = dict.fromkeys(self.keys, 0.0)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _check(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_check[key]:
+                return self._healthy[key]
+            self._next_check[key] = now + self.health_interval
+        try:
+            with self.engines[key].connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception as e:
+            logger.warning('replica %s failed its health check: %s', key, e)
+            healthy = False
+        self._healthy[key] = healthy
+        return healthy
+
+    '''
+    return the next healthy replica engine, None when there is none
+    '''
+    def choose(self):
+        start = next(self._counter)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            if self._check(key):
+                return self.engines[key]
+        return None
+
+    def status(self):
+        return {key: self._healthy[key] for key in self.keys}
+
+    def dispose(self):
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+'''
+return the engine options of the primary, plus a connect timeout on PostgreSQL
+'''
+
+
+def replica_engine_options(path):
+    options = engine_options(path)
+    if make_url(path).get_backend_name() == 'postgresql':
+        options['connect_args'] = dict(
+            options.get('connect_args', {}), connect_timeout=DB_REPLICA_CONNECT_TIMEOUT)
+    return options
+
+
+'''
+@INPUTS
+    app: the Flask app
+    replica_paths: replica database URLs
+
+create one engine per replica, with the same pool options as the primary
+and a connect timeout
+the replicas are not Flask-SQLAlchemy binds, so create_all and the
+migrations never touch them
+'''
+
+
+def init_replicas(app, replica_paths):
+    if not replica_paths:
+        return
+    app.extensions['db_replicas'] = ReplicaSet({
+        f'replica_{index}': create_engine(path, **replica_engine_options(path))
+        for index, path in enumerate(replica_paths)
+    })
+
+    @app.after_request
+    def remember_write(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(
+                READ_PRIMARY_COOKIE, '1', max_age=DB_READ_PRIMARY_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+        return response
+
+
+def reads_primary():
+    return READ_PRIMARY_COOKIE in request.cookies \
+        or request.headers.get('X-Read-Primary', '').lower() == 'true'
+
+
+'''
+route the queries of the current request to a replica, unless the client
+asked for its own writes
+return the chosen engine, None when the primary is used
+'''
+
+
+def route_to_replica():
+    replicas = current_app.extensions.get('db_replicas')
+    if replicas is None or reads_primary():
+        return None
+    engine = replicas.choose()
+    if engine is not None:
+        current_app.extensions['sqlalchemy'].session.info['replica'] = engine
+    return engine
+
+
+'''
+return the engine the reads of the current request go to: the replica
+route_to_replica chose, the primary otherwise (for work that bypasses the
+session, like a raw COPY connection)
+'''
+
+
+def read_engine():
+    db = current_app.extensions['sqlalchemy']
+    return db.session.info.get('replica') or db.engine
+
+
+def read_only(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        route_to_replica()
+        return f(*args, **kwargs)
+
+    return wrapper
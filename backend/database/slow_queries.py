@@ -0,0 +1,205 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+## Slow Query Log
+'''
+SlowQueryLog
+Logs the statements of the setup_db engines (primary and replicas) that take
+longer than a threshold
+
+it should log the statement, its bound parameters and the route that ran it
+it should, with SLOW_QUERY_EXPLAIN, capture the plan of a slow SELECT on
+    another connection from a background thread, never on the request path:
+    EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL, rolled back and bounded by
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS, EXPLAIN QUERY PLAN on SQLite
+it should only log a SLOW_QUERY_SAMPLE_RATE fraction of the slow statements
+    and at most SLOW_QUERY_MAX_PER_MINUTE of them (explains have their own,
+    lower, limit, ANALYZE runs the statement again)
+it should cost one perf_counter call per statement otherwise, and nothing
+    at all unless SLOW_QUERY_LOG is true
+'''
+
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "false").lower() == "true"
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 250))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", 1))
+SLOW_QUERY_MAX_PER_MINUTE = int(os.getenv("SLOW_QUERY_MAX_PER_MINUTE", 30))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+SLOW_QUERY_EXPLAIN_MAX_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAIN_MAX_PER_MINUTE", 2))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 10000))
+
+# longest repr of the bound parameters that is logged
+MAX_PARAMETERS_LENGTH = 1000
+
+
+class RateLimiter:
+    '''
+    A token bucket refilled with per_minute tokens a minute, up to per_minute
+    '''
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self._tokens = float(per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.capacity / 60)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def _route():
+    if not has_request_context():
+        return '-'
+    rule = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    return f'{request.method} {rule}'
+
+
+def _parameters(parameters):
+    text = repr(parameters)
+    if len(text) > MAX_PARAMETERS_LENGTH:
+        text = text[:MAX_PARAMETERS_LENGTH] + '...'
+    return text
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+                 sample_rate=SLOW_QUERY_SAMPLE_RATE,
+                 max_per_minute=SLOW_QUERY_MAX_PER_MINUTE,
+                 explain=SLOW_QUERY_EXPLAIN,
+                 explain_max_per_minute=SLOW_QUERY_EXPLAIN_MAX_PER_MINUTE,
+                 explain_timeout_ms=SLOW_QUERY_EXPLAIN_TIMEOUT_MS):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain = explain
+        self.explain_timeout_ms = explain_timeout_ms
+        self.logged = 0
+        self.dropped = 0
+        self._limiter = RateLimiter(max_per_minute)
+        self._explain_limiter = RateLimiter(explain_max_per_minute)
+        self._explains = queue.Queue(maxsize=8)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None or context.execution_options.get('slow_query_log') is False:
+            return
+        elapsed = time.perf_counter() - context.slow_query_start
+        if elapsed < self.threshold:
+            return
+        if random.random() >= self.sample_rate or not self._limiter.allow():
+            self.dropped += 1
+            return
+
+        self.logged += 1
+        route = _route()
+        logger.warning(
+            'slow query (%.1f ms) on %s:\n%s\nparameters: %s',
+            elapsed * 1000, route, statement, _parameters(parameters)
+        )
+        if self.explain and not executemany \
+                and statement.lstrip()[:6].upper() == 'SELECT' \
+                and self._explain_limiter.allow():
+            self._queue_explain(conn.engine, statement, parameters, route)
+
+    #  ----------------------------------------------------------------
+    #  Explain
+    #  ----------------------------------------------------------------
+
+    def _queue_explain(self, engine, statement, parameters, route):
+        try:
+            self._explains.put_nowait((engine, statement, parameters, route))
+        except queue.Full:
+            logger.info('slow query explain queue full, plan not captured')
+            return
+        self._start()
+
+    def _start(self):
+        # lazily, so that a gunicorn worker starts its own thread after the fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            engine, statement, parameters, route = self._explains.get()
+            try:
+                plan = self.explain_plan(engine, statement, parameters)
+                logger.warning('plan of slow query on %s:\n%s', route, plan)
+            except Exception as e:
+                logger.warning('could not explain slow query on %s: %s', route, e)
+            finally:
+                self._explains.task_done()
+
+    def explain_plan(self, engine, statement, parameters):
+        with engine.connect() as conn:
+            conn = conn.execution_options(slow_query_log=False)
+            with conn.begin() as transaction:
+                if engine.dialect.name == 'postgresql':
+                    conn.exec_driver_sql(
+                        f'SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}')
+                    explain = 'EXPLAIN (ANALYZE, BUFFERS) '
+                else:
+                    explain = 'EXPLAIN QUERY PLAN '
+                rows = conn.exec_driver_sql(explain + statement, parameters).all()
+                # ANALYZE ran the statement, nothing of it is kept
+                transaction.rollback()
+        return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+    def join(self):
+        '''
+        Waits until the queued plans are logged
+        '''
+        self._explains.join()
+
+
+'''
+@INPUTS
+    app: the app setup_db configured
+    db: its SQLAlchemy extension
+
+attaches a SlowQueryLog to the app's primary engine and to its read replicas,
+which run the list queries, when SLOW_QUERY_LOG is true; plans are captured on
+the engine that ran the statement
+return it, or None
+'''
+
+
+def init_slow_query_log(app, db):
+    if not SLOW_QUERY_LOG:
+        return None
+    slow_query_log = SlowQueryLog()
+    with app.app_context():
+        slow_query_log.attach(db.engine)
+    replicas = app.extensions.get('db_replicas')
+    if replicas is not None:
+        for engine in replicas.engines.values():
+            slow_query_log.attach(engine)
+    app.extensions['slow_query_log'] = slow_query_log
+    return slow_query_log
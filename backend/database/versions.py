@@ -0,0 +1,112 @@
+from sqlalchemy import event, insert, update
+from .models import db, TableVersion
+
+
+## Table Versions
+'''
+Every committed transaction that writes Movie, Actor or Casting increments the
+version of those tables in table_version, in the same transaction. The
+versions give list endpoints a cheap, cross-process marker of "nothing changed"
+(one primary key lookup instead of aggregating the tables).
+
+Writes are collected per session at flush time (ORM units of work) and on
+ORM-enabled insert/update/delete statements (bulk writes). Callbacks registered
+with on_commit receive the {(table, operation)} set once the commit succeeded.
+'''
+
+VERSIONED_TABLES = ('Movie', 'Actor', 'Casting')
+
+_commit_callbacks = []
+
+
+def on_commit(callback):
+    _commit_callbacks.append(callback)
+    return callback
+
+
+'''
+record that table was written in the session's transaction, for writes that
+bypass the ORM (e.g. COPY through the session's connection)
+'''
+
+
+def track_write(session, table, operation):
+    if table in VERSIONED_TABLES:
+        session.info.setdefault('written_tables', set()).add((table, operation))
+
+
+'''
+return {table name: version} for VERSIONED_TABLES in one statement
+'''
+
+
+def read_versions():
+    versions = dict.fromkeys(VERSIONED_TABLES, 0)
+    versions.update(db.session.execute(
+        db.select(TableVersion.table_name, TableVersion.version)
+    ).all())
+    return versions
+
+
+def _bump(session, tables):
+    result = session.execute(
+        update(TableVersion)
+        .where(TableVersion.table_name.in_(tables))
+        .values(version=TableVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount < len(tables):
+        existing = set(session.execute(
+            db.select(TableVersion.table_name)
+            .where(TableVersion.table_name.in_(tables))
+        ).scalars())
+        session.execute(insert(TableVersion), [
+            {'table_name': table, 'version': 1}
+            for table in sorted(tables - existing)
+        ])
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_flush(session, flush_context, instances):
+    for operation, objects in (('insert', session.new),
+                               ('update', session.dirty),
+                               ('delete', session.deleted)):
+        for obj in objects:
+            track_write(session, obj.__table__.name, operation)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _track_statement(orm_execute_state):
+    if orm_execute_state.is_insert:
+        operation = 'insert'
+    elif orm_execute_state.is_update:
+        operation = 'update'
+    elif orm_execute_state.is_delete:
+        operation = 'delete'
+    else:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None:
+        track_write(orm_execute_state.session, table.name, operation)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_on_commit(session):
+    # flush first so the objects still pending are tracked too
+    session.flush()
+    writes = session.info.get('written_tables')
+    if writes:
+        _bump(session, {table for table, _ in writes})
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_on_commit(session):
+    writes = session.info.pop('written_tables', None)
+    if writes:
+        for callback in _commit_callbacks:
+            callback(writes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_on_rollback(session):
+    session.info.pop('written_tables', None)
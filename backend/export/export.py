@@ -0,0 +1,180 @@
+import csv
+import io
+import json
+import queue
+import threading
+from sqlalchemy import exists, func, null
+from ..database.models import db, Movie, Actor, Casting
+from ..database.replicas import read_engine
+
+
+## Casting Graph Export
+'''
+Streams the whole Movie-Casting-Actor graph as one flat row per edge:
+every (movie, actor) casting, every movie without a cast (actor columns
+empty) and every actor without a movie (movie columns empty).
+
+Rows are read from a server-side cursor (yield_per) and written out in
+chunks, so memory stays constant however large the graph is. On PostgreSQL
+with psycopg2 the CSV export is produced by the database itself with
+COPY ... TO STDOUT and only relayed, on the replica the request was routed
+to when there is one.
+'''
+
+COLUMNS = (
+    'movie_id', 'movie_title', 'movie_release_date',
+    'actor_id', 'actor_name', 'actor_age', 'actor_gender'
+)
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 65536
+
+
+def graph_queries():
+    edges = db.select(
+        Movie.id, Movie.title, func.date(Movie.release_date),
+        Actor.id, Actor.name, Actor.age, Actor.gender
+    ).select_from(Movie) \
+        .outerjoin(Casting, Casting.movie_id == Movie.id) \
+        .outerjoin(Actor, Actor.id == Casting.actor_id) \
+        .order_by(Movie.id, Casting.id)
+    uncast = db.select(
+        null(), null(), null(),
+        Actor.id, Actor.name, Actor.age, Actor.gender
+    ).where(~exists().where(Casting.actor_id == Actor.id)) \
+        .order_by(Actor.id)
+    return edges, uncast
+
+
+def graph_rows(batch_size=EXPORT_BATCH_SIZE):
+    for query in graph_queries():
+        rows = db.session.execute(query.execution_options(yield_per=batch_size))
+        for row in rows:
+            yield row
+
+
+def _chunked(pieces, chunk_size=EXPORT_CHUNK_SIZE):
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _date(value):
+    # func.date() returns a date on PostgreSQL and an ISO string on SQLite
+    return None if value is None else str(value)
+
+
+def ndjson_export():
+    def lines():
+        for row in graph_rows():
+            record = dict(zip(COLUMNS, row))
+            record['movie_release_date'] = _date(record['movie_release_date'])
+            yield json.dumps(record, separators=(',', ':')) + '\n'
+
+    return _chunked(lines())
+
+
+def csv_export():
+    engine = read_engine()
+    if engine.dialect.name == 'postgresql' and engine.driver == 'psycopg2':
+        return copy_csv_export(engine)
+
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(COLUMNS)
+        for row in graph_rows():
+            row = list(row)
+            row[2] = _date(row[2])
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return lines()
+
+
+#  ----------------------------------------------------------------
+#  COPY ... TO STDOUT
+#  ----------------------------------------------------------------
+
+class _ExportCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    '''
+    File-like target for copy_expert. The queue is bounded, so the database
+    is only read as fast as the client consumes the response.
+    '''
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data):
+        while True:
+            if self.cancelled.is_set():
+                raise _ExportCancelled()
+            try:
+                self.chunks.put(data, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+def copy_csv_export(engine):
+    edges, uncast = graph_queries()
+    dialect = engine.dialect
+    # COPY would name the header after the select labels, COLUMNS is
+    # written instead
+    statements = [
+        f'COPY ({query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})}) '
+        'TO STDOUT WITH (FORMAT csv)'
+        for query in (edges, uncast)
+    ]
+
+    chunks = queue.Queue(maxsize=16)
+    cancelled = threading.Event()
+
+    def run():
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            writer = _QueueWriter(chunks, cancelled)
+            for statement in statements:
+                cursor.copy_expert(statement, writer)
+            connection.rollback()
+            chunks.put(None)
+        except _ExportCancelled:
+            connection.rollback()
+        except Exception as e:
+            connection.rollback()
+            chunks.put(e)
+        finally:
+            connection.close()
+
+    def lines():
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            yield ','.join(COLUMNS) + '\n'
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            cancelled.set()
+
+    return lines()
+
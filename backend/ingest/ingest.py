@@ -0,0 +1,365 @@
+import csv
+import io
+import json
+import os
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from ..database.models import db, Movie, Actor, Casting
+from ..database.bulk import validate_movies, validate_actors, validate_castings
+from ..database.versions import track_write
+
+
+## Bulk Import
+'''
+Loads movies, actors or castings from CSV or NDJSON files:
+
+    flask --app backend.app import movies movies.csv
+    flask --app backend.app import actors actors.ndjson
+    flask --app backend.app import castings castings.csv --resume
+
+Files are read in chunks of --chunk-size records, each chunk is validated
+like the bulk endpoints (database/bulk.py) and loaded in its own transaction,
+with COPY ... FROM STDIN on PostgreSQL (psycopg2) or batched executemany
+inserts elsewhere. Invalid records are skipped and reported, the rest of the
+chunk is loaded.
+
+Castings reference movies by "movie" (title) or "movie_id", actors by
+"actor" (name) or "actor_id". Titles and names are resolved through
+in-memory maps read once before the first chunk; a title or name that is
+not unique is rejected as ambiguous.
+
+After each committed chunk the number of records consumed is written to the
+checkpoint file, --resume skips them after a failure. A crash between the
+commit and the checkpoint write loads that one chunk again on resume (for
+castings the repeated pairs are rejected as already cast).
+'''
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+MAX_REPORTED_REJECTS = 20
+
+# kind -> (model, loaded columns, validator)
+IMPORT_KINDS = {
+    'movies': (Movie, ('title', 'release_date'), validate_movies),
+    'actors': (Actor, ('name', 'age', 'gender'), validate_actors),
+    'castings': (Casting, ('movie_id', 'actor_id'), validate_castings),
+}
+
+_AMBIGUOUS = object()
+
+
+#  ----------------------------------------------------------------
+#  Reading
+#  ----------------------------------------------------------------
+
+def file_format(path, format=None):
+    if format:
+        return format
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    raise click.UsageError(f'Cannot tell the format of {path}, pass --format.')
+
+
+'''
+@INPUTS
+    file: text file opened by the caller
+    format: 'csv' or 'ndjson'
+
+yield one dict per record, or None for an NDJSON line that is not valid JSON
+empty CSV fields are read as missing values
+'''
+
+
+def read_records(file, format):
+    if format == 'csv':
+        for record in csv.DictReader(file):
+            yield {key: value for key, value in record.items() if value != ''}
+        return
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+#  ----------------------------------------------------------------
+#  Casting references
+#  ----------------------------------------------------------------
+
+'''
+return {title or name: id}, _AMBIGUOUS for keys shared by several rows
+'''
+
+
+def id_map(key_column, id_column):
+    ids = {}
+    for key, id in db.session.execute(db.select(key_column, id_column)):
+        ids[key] = _AMBIGUOUS if key in ids else id
+    return ids
+
+
+class CastingReferences:
+    def __init__(self):
+        self.movies = id_map(Movie.title, Movie.id)
+        self.actors = id_map(Actor.name, Actor.id)
+
+    @staticmethod
+    def _resolve(record, field, ids, errors):
+        if record.get(f'{field}_id') is not None:
+            return record[f'{field}_id']
+        key = record.get(field)
+        if key is None:
+            return None
+        id = ids.get(key)
+        if id is None:
+            errors[field] = 'not found'
+        elif id is _AMBIGUOUS:
+            errors[field] = 'is ambiguous'
+        return id
+
+    '''
+    return (items for validate_castings, {position in records: errors})
+    '''
+    def resolve(self, records):
+        items = []
+        errors = {}
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                items.append(record)
+                continue
+            record_errors = {}
+            item = {
+                "movie": self._resolve(record, 'movie', self.movies, record_errors),
+                "actor": self._resolve(record, 'actor', self.actors, record_errors)
+            }
+            if record_errors:
+                errors[index] = record_errors
+            else:
+                items.append(item)
+        return items, errors
+
+
+def _validate_castings(records, references):
+    items, reference_errors = references.resolve(records)
+    rows, item_errors = validate_castings(items)
+    # item_errors index into items, map them back to positions in records
+    positions = [index for index in range(len(records)) if index not in reference_errors]
+    errors = [
+        {"index": positions[error["index"]], "errors": error["errors"]}
+        for error in item_errors
+    ]
+    errors.extend(
+        {"index": index, "errors": record_errors}
+        for index, record_errors in reference_errors.items()
+    )
+    errors.sort(key=lambda error: error["index"])
+    return rows, errors
+
+
+#  ----------------------------------------------------------------
+#  Loading
+#  ----------------------------------------------------------------
+
+def can_copy():
+    return db.engine.dialect.name == 'postgresql' and db.engine.driver == 'psycopg2'
+
+
+def _copy_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def copy_rows(model, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+
+    # the session's own connection, so the chunk commits with the
+    # table version bump
+    cursor = db.session.connection().connection.cursor()
+    names = ', '.join(columns)
+    cursor.copy_expert(
+        f'COPY "{model.__tablename__}" ({names}) FROM STDIN WITH (FORMAT csv)',
+        buffer
+    )
+    track_write(db.session, model.__tablename__, 'insert')
+
+
+def insert_rows(model, columns, rows):
+    db.session.execute(insert(model), rows)
+
+
+#  ----------------------------------------------------------------
+#  Checkpoints
+#  ----------------------------------------------------------------
+
+def read_checkpoint(path, kind, source):
+    with open(path) as file:
+        checkpoint = json.load(file)
+    if checkpoint.get('kind') != kind or checkpoint.get('source') != os.path.abspath(source):
+        raise click.ClickException(f'{path} is the checkpoint of another import.')
+    if checkpoint.get('size') != os.path.getsize(source):
+        raise click.ClickException(f'{source} changed since {path} was written.')
+    return checkpoint
+
+
+def write_checkpoint(path, kind, source, records, loaded, rejected):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({
+            'kind': kind,
+            'source': os.path.abspath(source),
+            'size': os.path.getsize(source),
+            'records': records,
+            'loaded': loaded,
+            'rejected': rejected
+        }, file)
+    os.replace(temporary, path)
+
+
+#  ----------------------------------------------------------------
+#  Import
+#  ----------------------------------------------------------------
+
+'''
+@INPUTS
+    kind: 'movies', 'actors' or 'castings'
+    source: path of the CSV or NDJSON file
+    checkpoint: path of the checkpoint file
+    resume: skip the records consumed by a previous run
+    method: 'auto', 'copy' or 'insert'
+    rejects: optional text file every rejected record is written to
+
+return {'records', 'loaded', 'rejected', 'seconds'}
+'''
+
+
+def import_file(kind, source, format=None, chunk_size=IMPORT_CHUNK_SIZE,
+                checkpoint=None, resume=False, method='auto', rejects=None,
+                echo=click.echo):
+    model, columns, validate = IMPORT_KINDS[kind]
+    format = file_format(source, format)
+    checkpoint = checkpoint or source + '.checkpoint'
+    if method == 'auto':
+        method = 'copy' if can_copy() else 'insert'
+    if method == 'copy' and not can_copy():
+        raise click.UsageError('COPY needs PostgreSQL with psycopg2.')
+    load = copy_rows if method == 'copy' else insert_rows
+
+    records = loaded = rejected = 0
+    if os.path.exists(checkpoint):
+        if not resume:
+            raise click.ClickException(
+                f'{checkpoint} exists, pass --resume to continue that import or delete it.')
+        state = read_checkpoint(checkpoint, kind, source)
+        records, loaded, rejected = state['records'], state['loaded'], state['rejected']
+        echo(f'{kind}: resuming after {records:,} records', err=True)
+
+    references = CastingReferences() if kind == 'castings' else None
+    size = os.path.getsize(source) or 1
+    started = time.monotonic()
+    loaded_before = loaded
+
+    with open(source, newline='', encoding='utf-8') as file:
+        stream = read_records(file, format)
+        for _ in range(records):
+            next(stream, None)
+
+        for chunk in read_chunks(stream, chunk_size):
+            try:
+                if references is not None:
+                    rows, errors = _validate_castings(chunk, references)
+                else:
+                    rows, errors = validate(chunk)
+                if rows:
+                    load(model, columns, rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                echo(f'{kind}: failed in the chunk after record {records:,}, '
+                     'rerun with --resume to continue from there', err=True)
+                raise
+
+            for error in errors:
+                line = records + error['index'] + 1
+                if rejects is not None:
+                    rejects.write(json.dumps({'record': line, 'errors': error['errors']}) + '\n')
+                elif rejected < MAX_REPORTED_REJECTS:
+                    echo(f'{kind}: record {line:,} rejected: {error["errors"]}', err=True)
+                rejected += 1
+            records += len(chunk)
+            loaded += len(rows)
+            write_checkpoint(checkpoint, kind, source, records, loaded, rejected)
+
+            elapsed = time.monotonic() - started
+            echo(f'{kind}: {records:,} records, {loaded:,} loaded, {rejected:,} rejected, '
+                 f'{min(file.buffer.tell() / size, 1):.0%} of file, '
+                 f'{(loaded - loaded_before) / max(elapsed, 1e-9):,.0f} rows/s', err=True)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return {
+        'records': records,
+        'loaded': loaded,
+        'rejected': rejected,
+        'seconds': time.monotonic() - started
+    }
+
+
+#  ----------------------------------------------------------------
+#  CLI
+#  ----------------------------------------------------------------
+
+import_cli = AppGroup('import', help='Bulk import movies, actors or castings from CSV or NDJSON files.')
+
+
+def _import_command(kind):
+    @import_cli.command(kind, help=f'Import {kind} from SOURCE.')
+    @click.argument('source', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', type=click.Choice(['csv', 'ndjson']),
+                  help='File format, guessed from the extension by default.')
+    @click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True,
+                  type=click.IntRange(min=1), help='Records per transaction.')
+    @click.option('--method', default='auto', show_default=True,
+                  type=click.Choice(['auto', 'copy', 'insert']),
+                  help='COPY on PostgreSQL, batched inserts otherwise.')
+    @click.option('--checkpoint', type=click.Path(dir_okay=False),
+                  help='Checkpoint file, SOURCE.checkpoint by default.')
+    @click.option('--resume', is_flag=True,
+                  help='Continue an import that failed from its checkpoint.')
+    @click.option('--rejects', type=click.File('w'),
+                  help='Write every rejected record to this file (NDJSON).')
+    def command(source, format, chunk_size, method, checkpoint, resume, rejects):
+        result = import_file(
+            kind, source, format=format, chunk_size=chunk_size,
+            checkpoint=checkpoint, resume=resume, method=method, rejects=rejects
+        )
+        click.echo(
+            f'{kind}: {result["loaded"]:,} loaded, {result["rejected"]:,} rejected '
+            f'of {result["records"]:,} records in {result["seconds"]:.1f}s'
+        )
+
+    return command
+
+
+for _kind in IMPORT_KINDS:
+    _import_command(_kind)
@@ -0,0 +1,79 @@
+import os
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+## JSON Provider
+'''
+JSON provider of the app: orjson when it is installed, the standard library
+otherwise (JSON_PROVIDER=orjson|stdlib|auto)
+
+it should encode dates and datetimes as ISO 8601 ("2020-01-01",
+    "2020-01-01T00:00:00"), so models can hand out date objects instead of
+    formatting strings per row; orjson does it natively
+it should keep Flask's defaults otherwise: sorted keys, compact output
+    unless debugging, the other types Flask's provider knows
+'''
+
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto").lower()
+
+
+def _default(o):
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    '''
+    Serializes with orjson, only falling back to the standard library for
+    the options orjson does not have (indent other than 2, custom separators
+    or encoders)
+    '''
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=_default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.pop("indent", None)
+        if kwargs.pop("separators", (",", ":")) != (",", ":") or kwargs:
+            return super().dumps(obj, indent=indent, **kwargs)
+        if indent not in (None, 2):
+            return super().dumps(obj, indent=indent)
+        option = self._options() | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        return self._app.response_class(
+            self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype
+        )
+
+
+def json_provider_class(name=JSON_PROVIDER):
+    if name == "stdlib" or (name == "auto" and orjson is None):
+        return StdlibJSONProvider
+    if orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson but orjson is not installed.")
+    return OrjsonProvider
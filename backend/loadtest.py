@@ -0,0 +1,119 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+## Load Test
+'''
+Measures how many concurrent requests a serving mode handles per worker
+(see README.md, Serving)
+
+    python -m backend.loadtest stub --delay 0.2
+    python -m backend.loadtest run http://127.0.0.1:8000/login \\
+        --json '{"username": "load", "password": "test"}' -c 32 -n 640
+
+stub: a stand-in for the Auth0 token endpoint that answers every request
+    after --delay seconds, point AUTH0_TOKEN_URL at it
+run: sends -n requests from -c client threads and prints the throughput and
+    latency percentiles
+'''
+
+
+def stub(port, delay):
+    class TokenHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            body = json.dumps({
+                "access_token": "stub-token",
+                "token_type": "Bearer",
+                "expires_in": 86400
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), TokenHandler)
+    server.daemon_threads = True
+    print(f'token endpoint: AUTH0_TOKEN_URL=http://127.0.0.1:{port}/oauth/token ({delay}s per request)')
+    server.serve_forever()
+
+
+def _send(url, body, headers):
+    request = Request(url, data=body, headers=headers, method='POST' if body else 'GET')
+    started = time.perf_counter()
+    try:
+        with urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - started
+
+
+def _percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def run(url, concurrency, requests, body=None, headers=()):
+    headers = dict(header.split(':', 1) for header in headers)
+    if body is not None:
+        body = body.encode()
+        headers.setdefault('Content-Type', 'application/json')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: _send(url, body, headers), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status is None or status >= 400)
+    report = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'latency_p50': round(statistics.median(latencies), 4),
+        'latency_p90': round(_percentile(latencies, 0.9), 4),
+        'latency_p99': round(_percentile(latencies, 0.99), 4),
+        'latency_max': round(latencies[-1], 4)
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the API serving modes.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stub_parser = commands.add_parser('stub', help='Run a slow stand-in Auth0 token endpoint.')
+    stub_parser.add_argument('--port', type=int, default=8089)
+    stub_parser.add_argument('--delay', type=float, default=0.2)
+
+    run_parser = commands.add_parser('run', help='Send concurrent requests to URL.')
+    run_parser.add_argument('url')
+    run_parser.add_argument('-c', '--concurrency', type=int, default=32)
+    run_parser.add_argument('-n', '--requests', type=int, default=640)
+    run_parser.add_argument('--json', help='POST this body instead of a GET.')
+    run_parser.add_argument('-H', '--header', action='append', default=[],
+                            help='Extra "Name: value" header, repeatable.')
+
+    args = parser.parse_args()
+    if args.command == 'stub':
+        stub(args.port, args.delay)
+    else:
+        run(args.url, args.concurrency, args.requests, args.json, args.header)
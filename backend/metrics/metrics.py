@@ -0,0 +1,200 @@
+import hmac
+import os
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+    multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import NotFound
+
+
+## Metrics
+'''
+Prometheus histograms of where request time goes, served from /metrics
+
+it should time every request by method, route (the url rule, never the raw
+    path) and status
+it should count the SQL statements of every request and the time spent
+    executing them, on the primary and the replicas
+it should time the steps of requires_auth: the token cache lookup, the
+    signing key lookup (a JWKS fetch when the keys are stale), the RSA
+    signature and claims verification and the permission check
+it should count the verified token cache hits, misses and evictions
+it should aggregate the histograms and counters of every gunicorn worker when
+    PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it), a worker
+    alone only knows the requests it served
+it should add a Server-Timing header to every response when SERVER_TIMING
+    is true, for the browser dev tools; it exposes internals, keep it off in
+    production
+it should only serve /metrics to a scraper sending METRICS_TOKEN as a bearer
+    token when it is set, the JSON 404 otherwise; without it /metrics is
+    public and must be firewalled off at the load balancer
+
+The request is timed from before_request to the last after_request hook, a
+streamed body (exports, ?stream=true) is not included.
+'''
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request, by route',
+    ['method', 'route', 'status']
+)
+SQL_STATEMENTS = Histogram(
+    'db_statements_per_request',
+    'SQL statements executed by a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+SQL_DURATION = Histogram(
+    'db_duration_per_request_seconds',
+    'Time a request spent executing SQL statements',
+    ['route']
+)
+AUTH_DURATION = Histogram(
+    'auth_duration_seconds',
+    'Time spent in requires_auth, by step',
+    ['step'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+             0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+TOKEN_CACHE_EVENTS = Counter(
+    'auth_token_cache_events',
+    'Verified token cache hits, misses and evictions',
+    ['event']
+)
+
+
+def token_cache_event(event):
+    TOKEN_CACHE_EVENTS.labels(event).inc()
+
+
+def _timings():
+    if not has_request_context():
+        return None
+    if 'metrics_timings' not in g:
+        g.metrics_timings = {}
+    return g.metrics_timings
+
+
+'''
+@INPUTS
+    step: 'token_cache', 'jwks', 'verify' or 'permissions'
+
+times the block into auth_duration_seconds and the request's Server-Timing
+'''
+
+
+@contextmanager
+def auth_step(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        AUTH_DURATION.labels(step).observe(elapsed)
+        timings = _timings()
+        if timings is not None:
+            timings['auth-' + step] = timings.get('auth-' + step, 0) + elapsed
+
+
+#  ----------------------------------------------------------------
+#  SQL
+#  ----------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not has_request_context() or 'metrics_start' not in g:
+        return
+    g.db_statements += 1
+    g.db_duration += time.perf_counter() - context.metrics_start
+
+
+#  ----------------------------------------------------------------
+#  Requests
+#  ----------------------------------------------------------------
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_duration = 0.0
+
+
+def _finish_request(response):
+    if 'metrics_start' not in g or request.endpoint == 'metrics':
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    route = _route()
+    REQUEST_DURATION.labels(request.method, route, str(response.status_code)).observe(elapsed)
+    SQL_STATEMENTS.labels(route).observe(g.db_statements)
+    SQL_DURATION.labels(route).observe(g.db_duration)
+
+    if SERVER_TIMING:
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in _timings().items()]
+        entries.append(f'db;dur={g.db_duration * 1000:.2f};desc="{g.db_statements} statements"')
+        entries.append(f'app;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+'''
+return the registry to expose: every worker's metrics merged from
+PROMETHEUS_MULTIPROC_DIR under gunicorn, this process' otherwise
+'''
+
+
+def registry():
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged)
+    return merged
+
+
+def _authorized():
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(),
+        f'Bearer {METRICS_TOKEN}'.encode()
+    )
+
+
+def metrics():
+    # a 404 rather than a 401, the endpoint is not advertised to strangers
+    if not _authorized():
+        raise NotFound()
+    return generate_latest(registry()), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+'''
+registered before the other after_request hooks (compression) so that they
+are part of the measured time
+'''
+
+
+def init_metrics(app):
+    if not METRICS_ENABLED:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
@@ -0,0 +1,57 @@
+"""add list filter and sort indexes
+
+Revision ID: 5c1e7a3f2d90
+Revises: 9b4263c685b8
+Create Date: 2026-10-18 10:12:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a3f2d90'
+down_revision = '9b4263c685b8'
+branch_labels = None
+depends_on = None
+
+
+def create_text_indexes(table, column):
+    # prefix filters use a text_pattern_ops b-tree, substring filters a
+    # pg_trgm GIN index; other databases get a plain index on lower(column)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(f'ix_{table}_{column}_lower_pattern', table,
+                        [sa.text(f'lower({column}) text_pattern_ops')])
+        op.create_index(f'ix_{table}_{column}_trgm', table,
+                        [sa.text(f'lower({column}) gin_trgm_ops')],
+                        postgresql_using='gin')
+    else:
+        op.create_index(f'ix_{table}_{column}_lower_pattern', table,
+                        [sa.text(f'lower({column})')])
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    create_text_indexes('Movie', 'title')
+    op.create_index('ix_Movie_title_id', 'Movie', ['title', 'id'])
+    op.create_index('ix_Movie_release_date_id', 'Movie', ['release_date', 'id'])
+
+    create_text_indexes('Actor', 'name')
+    op.create_index('ix_Actor_name_id', 'Actor', ['name', 'id'])
+    op.create_index('ix_Actor_age_id', 'Actor', ['age', 'id'])
+    op.create_index('ix_Actor_gender', 'Actor', ['gender'])
+
+
+def downgrade():
+    op.drop_index('ix_Actor_gender', table_name='Actor')
+    op.drop_index('ix_Actor_age_id', table_name='Actor')
+    op.drop_index('ix_Actor_name_id', table_name='Actor')
+    op.drop_index('ix_Actor_name_lower_pattern', table_name='Actor')
+    op.drop_index('ix_Movie_release_date_id', table_name='Movie')
+    op.drop_index('ix_Movie_title_id', table_name='Movie')
+    op.drop_index('ix_Movie_title_lower_pattern', table_name='Movie')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_Actor_name_trgm', table_name='Actor')
+        op.drop_index('ix_Movie_title_trgm', table_name='Movie')
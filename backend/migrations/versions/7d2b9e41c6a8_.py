@@ -0,0 +1,88 @@
+"""index Casting foreign keys and make (movie_id, actor_id) unique
+
+Revision ID: 7d2b9e41c6a8
+Revises: 5c1e7a3f2d90
+Create Date: 2026-10-18 11:03:27.118640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2b9e41c6a8'
+down_revision = '5c1e7a3f2d90'
+branch_labels = None
+depends_on = None
+
+
+# attempts at the unique index while the old code may still insert duplicates
+UNIQUE_INDEX_ATTEMPTS = 3
+
+
+def drop_invalid_index(bind, name):
+    # a failed or cancelled CREATE INDEX CONCURRENTLY leaves an INVALID index
+    # behind, which IF NOT EXISTS would then keep instead of building it
+    invalid = bind.execute(sa.text(
+        'SELECT NOT i.indisvalid FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+    ), {"name": name}).scalar()
+    if invalid:
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # CONCURRENTLY cannot run inside a transaction. Each statement below
+        # commits on its own so Casting stays writable while the indexes build.
+        with op.get_context().autocommit_block():
+            drop_invalid_index(bind, 'ix_Casting_actor_id')
+            op.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_Casting_actor_id" '
+                'ON "Casting" (actor_id)'
+            )
+            # a duplicate inserted between the dedupe and the end of the build
+            # fails the build; dedupe again and rebuild
+            for attempt in range(1, UNIQUE_INDEX_ATTEMPTS + 1):
+                drop_invalid_index(bind, 'uq_Casting_movie_id_actor_id')
+                # keep the oldest row of every duplicated pair
+                op.execute(
+                    'DELETE FROM "Casting" a USING "Casting" b '
+                    'WHERE a.movie_id = b.movie_id AND a.actor_id = b.actor_id '
+                    'AND a.id > b.id'
+                )
+                try:
+                    op.execute(
+                        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+                        '"uq_Casting_movie_id_actor_id" ON "Casting" (movie_id, actor_id)'
+                    )
+                    break
+                except sa.exc.IntegrityError:
+                    if attempt == UNIQUE_INDEX_ATTEMPTS:
+                        drop_invalid_index(bind, 'uq_Casting_movie_id_actor_id')
+                        raise
+            exists = bind.execute(sa.text(
+                "SELECT 1 FROM pg_constraint WHERE conname = 'uq_Casting_movie_id_actor_id'"
+            )).scalar()
+            if not exists:
+                op.execute(
+                    'ALTER TABLE "Casting" ADD CONSTRAINT "uq_Casting_movie_id_actor_id" '
+                    'UNIQUE USING INDEX "uq_Casting_movie_id_actor_id"'
+                )
+    else:
+        op.create_index('ix_Casting_actor_id', 'Casting', ['actor_id'])
+        op.execute(
+            'DELETE FROM "Casting" WHERE id NOT IN '
+            '(SELECT MIN(id) FROM "Casting" GROUP BY movie_id, actor_id)'
+        )
+        with op.batch_alter_table('Casting') as batch_op:
+            batch_op.create_unique_constraint(
+                'uq_Casting_movie_id_actor_id', ['movie_id', 'actor_id']
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('Casting') as batch_op:
+        batch_op.drop_constraint('uq_Casting_movie_id_actor_id', type_='unique')
+    op.drop_index('ix_Casting_actor_id', table_name='Casting')
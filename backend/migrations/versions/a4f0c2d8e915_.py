@@ -0,0 +1,39 @@
+"""add updated_at columns and table_version counters
+
+Revision ID: a4f0c2d8e915
+Revises: 7d2b9e41c6a8
+Create Date: 2026-10-18 12:26:03.745918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f0c2d8e915'
+down_revision = '7d2b9e41c6a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Movie', 'Actor', 'Casting'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+
+    table_version = op.create_table('table_version',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.bulk_insert(table_version, [
+        {'table_name': 'Movie', 'version': 1},
+        {'table_name': 'Actor', 'version': 1},
+        {'table_name': 'Casting', 'version': 1},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_version')
+    for table in ('Casting', 'Actor', 'Movie'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
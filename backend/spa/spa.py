@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import threading
+from flask import request
+from werkzeug.exceptions import NotFound
+from ..compression.compression import COMPRESSORS, compress, encoded_etag, negotiate
+
+
+## Single Page App
+'''
+Serving of the built frontend (frontend/dist) next to the API
+
+it should answer every client route with index.html in place, from memory,
+    with an ETag so a reload costs a 304
+it should give the hashed bundle files (js/app.3f2a1b4c.js) a year of
+    immutable caching, their name changes whenever their content does
+it should answer misses under an API prefix (/movies/..., /export/...) with
+    the JSON 404 without touching the filesystem
+'''
+
+# Vue CLI appends an 8 hex digit content hash to bundle file names
+HASHED_ASSET = re.compile(r'\.[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class SpaIndex:
+    def __init__(self):
+        self._path = None
+        self._mtime = None
+        self._etag = None
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    '''
+    @INPUTS
+        static_folder: the app's static folder
+        reload: re-read the file when it changed on disk (debug mode)
+
+    return (etag, {encoding: body}) of index.html, read once per process
+    raise NotFound when the frontend has not been built
+    '''
+    def load(self, static_folder, reload=False):
+        path = os.path.join(static_folder, 'index.html')
+        with self._lock:
+            if path == self._path and not reload:
+                return self._etag, self._bodies
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if path != self._path or mtime != self._mtime:
+                    with open(path, 'rb') as file:
+                        data = file.read()
+                    self._path, self._mtime = path, mtime
+                    self._etag = hashlib.sha1(data).hexdigest()
+                    self._bodies = {None: data}
+            except OSError:
+                raise NotFound()
+            return self._etag, self._bodies
+
+    def body(self, bodies, encoding):
+        if encoding not in bodies:
+            bodies[encoding] = compress(bodies[None], encoding)
+        return bodies[encoding]
+
+    def response(self, app):
+        etag, bodies = self.load(app.static_folder, reload=app.debug)
+        encoding = negotiate(COMPRESSORS)
+        response = app.response_class(self.body(bodies, encoding), mimetype='text/html')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            response.set_etag(etag)
+        else:
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(encoded_etag(etag, encoding))
+        return response.make_conditional(request)
+
+
+spa_index = SpaIndex()
+
+
+'''
+return the first path segment of every API route, e.g. {'movies', 'export'}
+'''
+
+
+def api_prefixes(app):
+    prefixes = set()
+    for rule in app.url_map.iter_rules():
+        segment = rule.rule.lstrip('/').split('/')[0]
+        if rule.endpoint != 'static' and segment and '<' not in segment:
+            prefixes.add(segment)
+    return prefixes
+
+
+def init_spa(app):
+    prefixes = api_prefixes(app)
+    serve_static = app.view_functions['static']
+
+    # the static rule (static_url_path='/') matches any GET path, so it also
+    # receives the client routes and the misses
+    def static(filename):
+        segments = filename.split('/')
+        if len(segments) > 1 and segments[0] in prefixes:
+            raise NotFound()
+        if '.' not in segments[-1]:
+            return spa_index.response(app)
+        response = serve_static(filename=filename)
+        if HASHED_ASSET.search(filename) and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    app.view_functions['static'] = static
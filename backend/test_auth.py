@@ -0,0 +1,370 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from flask import Flask
+from backend.auth import auth
+from backend.auth.auth import (
+    AuthError, VerifiedPayload, check_permissions, compile_permissions,
+    requires_auth, verify_decode_jwt
+)
+from backend.auth.auth0 import Auth0Client, CircuitBreaker, CircuitOpenError
+from backend.auth.jwks import JWKSKeyStore, JWKSUnavailableError
+from backend.auth.token_cache import TokenCache
+from backend.auth.testing import (
+    LocalJWKSServer, LocalTokenServer, generate_signing_key, mint_token
+)
+
+DOMAIN = 'casting-agency.test'
+AUDIENCE = 'casting-agency'
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key cache test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = generate_signing_key('key-1', bits=1024)
+        cls.rotated_key = generate_signing_key('key-2', bits=1024)
+
+    def setUp(self):
+        self.server = LocalJWKSServer([self.key]).start()
+        self.store = JWKSKeyStore(self.server.url, ttl=60, min_refetch_interval=60)
+
+    def tearDown(self):
+        self.store.stop()
+        self.server.stop()
+
+    def verify(self, token):
+        patches = {
+            'jwks_store': self.store,
+            'AUTH0_DOMAIN': DOMAIN,
+            'API_AUDIENCE': AUDIENCE,
+            'ALGORITHMS': ['RS256'],
+        }
+        with mock.patch.multiple(auth, **patches):
+            return verify_decode_jwt(token)
+
+    def test_keys_are_fetched_once_within_ttl(self):
+        token = mint_token(self.key, {'permissions': []}, DOMAIN, AUDIENCE)
+
+        for _ in range(5):
+            payload = self.verify(token)
+
+        self.assertEqual(payload['aud'], AUDIENCE)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_unknown_kid_triggers_rate_limited_refetch(self):
+        self.store.get_key('key-1')
+        self.server.keys.append(self.rotated_key['jwk'])
+        self.store.min_refetch_interval = 0
+
+        token = mint_token(self.rotated_key, {'permissions': []}, DOMAIN, AUDIENCE)
+        self.verify(token)
+        self.assertEqual(self.server.hits, 2)
+
+        self.store.min_refetch_interval = 60
+        for _ in range(5):
+            self.assertIsNone(self.store.get_key('missing'))
+        self.assertEqual(self.server.hits, 2)
+
+    def test_stale_keys_are_served_while_endpoint_is_down(self):
+        token = mint_token(self.key, {'permissions': []}, DOMAIN, AUDIENCE)
+        self.verify(token)
+
+        self.server.available = False
+        self.store.ttl = 0
+        payload = self.verify(token)
+
+        self.assertEqual(payload['aud'], AUDIENCE)
+
+    def test_stale_revalidation_is_rate_limited_while_endpoint_is_down(self):
+        self.store.get_key('key-1')
+        self.server.available = False
+        self.store.ttl = 0
+        # the keys were fetched min_refetch_interval ago
+        self.store._last_attempt -= self.store.min_refetch_interval
+
+        for _ in range(50):
+            self.assertIsNotNone(self.store.get_key('key-1'))
+            deadline = time.monotonic() + 5
+            while self.store._refreshing and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # the first fetch and a single revalidation within min_refetch_interval
+        self.assertEqual(self.server.hits, 2)
+
+    def test_background_refresh_replaces_keys(self):
+        self.store.ttl = 0.05
+        self.store.background_refresh = True
+        self.store.get_key('key-1')
+        self.server.keys = [self.rotated_key['jwk']]
+
+        deadline = time.monotonic() + 5
+        while self.store.get_key('key-2') is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertIsNotNone(self.store.get_key('key-2'))
+
+    def test_unreachable_endpoint_without_cached_keys(self):
+        self.server.available = False
+
+        with self.assertRaises(JWKSUnavailableError):
+            self.store.get_key('key-1')
+        with self.assertRaises(AuthError) as context:
+            self.verify(mint_token(self.key, {}, DOMAIN, AUDIENCE))
+        self.assertEqual(context.exception.status_code, 503)
+        # failed fast, without another fetch within min_refetch_interval
+        self.assertEqual(self.server.hits, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def test_lru_eviction(self):
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.set('a', {'exp': exp})
+        cache.set('b', {'exp': exp})
+        cache.get('a')
+        cache.set('c', {'exp': exp})
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_events_are_reported(self):
+        events = []
+
+        # outside the lock, a slow callback must not serialize the lookups
+        def on_event(event):
+            self.assertFalse(cache._lock.locked())
+            events.append(event)
+
+        cache = TokenCache(maxsize=1, on_event=on_event)
+        exp = time.time() + 60
+        cache.set('a', {'exp': exp})
+        cache.get('a')
+        cache.set('b', {'exp': exp})
+        cache.get('a')
+
+        self.assertEqual(events, ['hit', 'eviction', 'miss'])
+
+    def test_expired_tokens_are_not_served(self):
+        cache = TokenCache()
+        cache.set('expired', {'exp': time.time() - 1})
+        cache.set('expiring', {'exp': time.time() + 0.05})
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get('expired'))
+        self.assertIsNone(cache.get('expiring'))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_hit_skips_verification_but_checks_permissions(self):
+        app = Flask(__name__)
+        cache = TokenCache()
+        payload = {'exp': time.time() + 60, 'permissions': ['get:movies']}
+
+        @requires_auth('get:movies')
+        def allowed(payload):
+            return payload
+
+        @requires_auth('delete:movies')
+        def denied(payload):
+            return payload
+
+        headers = {'Authorization': 'Bearer cached-token'}
+        with mock.patch.object(auth, 'token_cache', cache), \
+                mock.patch.object(auth, 'verify_decode_jwt', return_value=payload) as verify, \
+                app.test_request_context(headers=headers):
+            allowed()
+            allowed()
+            with self.assertRaises(AuthError) as context:
+                denied()
+
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(context.exception.status_code, 403)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """This class represents the compiled permissions test case"""
+
+    def setUp(self):
+        self.payload = VerifiedPayload({'permissions': ['get:movies', 'get:actors']})
+
+    def test_single_permission(self):
+        self.assertTrue(check_permissions('get:movies', self.payload))
+        with self.assertRaises(AuthError) as context:
+            check_permissions('post:movies', self.payload)
+        self.assertEqual(context.exception.status_code, 403)
+
+    def test_any_of_and_all_of(self):
+        any_of = compile_permissions(any_of=['post:movies', 'get:actors'])
+        all_of = compile_permissions(all_of=['get:movies', 'post:movies'])
+
+        self.assertTrue(check_permissions(any_of, self.payload))
+        with self.assertRaises(AuthError):
+            check_permissions(all_of, self.payload)
+
+    def test_missing_permissions_claim(self):
+        with self.assertRaises(AuthError) as context:
+            check_permissions('get:movies', VerifiedPayload({'sub': 'user'}))
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_payload_permission_set_is_built_once(self):
+        self.assertEqual(
+            self.payload.permission_set,
+            frozenset(['get:movies', 'get:actors'])
+        )
+        self.assertEqual(self.payload['permissions'], ['get:movies', 'get:actors'])
+
+
+class Auth0ClientTestCase(unittest.TestCase):
+    """This class represents the /login token client test case"""
+
+    def setUp(self):
+        self.server = LocalTokenServer().start()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        self.client = Auth0Client(self.server.url, read_timeout=1, retries=2,
+                                  backoff=0, breaker=self.breaker)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_reuses_connections(self):
+        for _ in range(5):
+            self.assertEqual(self.client.request_token({}).status_code, 200)
+        self.assertEqual(self.server.hits, 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [503, 502]
+        self.assertEqual(self.client.request_token({}).status_code, 200)
+        self.assertEqual(self.server.hits, 3)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_client_errors_are_not_retried_nor_failures(self):
+        self.server.statuses = [403]
+        self.assertEqual(self.client.request_token({}).status_code, 403)
+        self.assertEqual(self.server.hits, 1)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_circuit_opens_then_lets_one_trial_through(self):
+        self.server.statuses = [503] * 6
+        for _ in range(2):
+            self.assertEqual(self.client.request_token({}).status_code, 503)
+        self.assertEqual(self.breaker.state, 'open')
+
+        hits = self.server.hits
+        with self.assertRaises(CircuitOpenError):
+            self.client.request_token({})
+        self.assertEqual(self.server.hits, hits)
+
+        time.sleep(0.25)
+        self.assertEqual(self.client.request_token({}).status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_any_exception_ends_the_half_open_trial(self):
+        self.server.statuses = [503] * 6
+        for _ in range(2):
+            self.client.request_token({})
+        time.sleep(0.25)
+
+        with mock.patch.object(self.client.session, 'post', side_effect=ValueError('bad')):
+            with self.assertRaises(ValueError):
+                self.client.request_token({})
+        self.assertEqual(self.breaker.state, 'open')
+
+        time.sleep(0.25)
+        self.server.statuses = []
+        self.assertEqual(self.client.request_token({}).status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_read_timeouts_are_not_retried(self):
+        self.server.delay = 1
+        client = Auth0Client(self.server.url, read_timeout=0.2, retries=2, backoff=0,
+                             breaker=self.breaker)
+        started = time.monotonic()
+        try:
+            with self.assertRaises(Exception):
+                client.request_token({})
+        finally:
+            client.close()
+        self.assertEqual(self.server.hits, 1)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_retry_after_is_capped(self):
+        self.server.statuses = [429]
+        self.server.retry_after = 30
+        client = Auth0Client(self.server.url, retries=2, max_retry_wait=0.1,
+                             breaker=self.breaker)
+        started = time.monotonic()
+        try:
+            self.assertEqual(client.request_token({}).status_code, 200)
+        finally:
+            client.close()
+        self.assertEqual(self.server.hits, 2)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_timeouts_count_as_failures(self):
+        self.server.delay = 0.3
+        client = Auth0Client(self.server.url, read_timeout=0.1, retries=0, breaker=self.breaker)
+        try:
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    client.request_token({})
+        finally:
+            client.close()
+        self.assertEqual(self.breaker.state, 'open')
+
+
+class LoginTestCase(unittest.TestCase):
+    """This class represents the /login endpoint test case"""
+
+    def setUp(self):
+        self.server = LocalTokenServer().start()
+        with mock.patch.dict(os.environ, {
+            "AUTH0_TOKEN_URL": self.server.url,
+            "AUTH0_RETRY_BACKOFF": "0",
+            "AUTH0_BREAKER_THRESHOLD": "1"
+        }):
+            from backend.app import create_app
+            self.app = create_app({"database_path": "sqlite://"})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions["auth0_client"].close()
+        self.server.stop()
+
+    def login(self):
+        return self.client.post("/login", json={"username": "u", "password": "p"})
+
+    def test_login(self):
+        res = self.login()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["data"]["access_token"], "token")
+
+    def test_wrong_credentials(self):
+        self.server.statuses = [403]
+        self.assertEqual(self.login().status_code, 422)
+
+    def test_503_while_auth0_is_down(self):
+        self.server.statuses = [503] * 3
+        res = self.login()
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.server.hits, 3)
+
+        res = self.login()
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.get_json()["message"], "Service Unavailable")
+        self.assertEqual(self.server.hits, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
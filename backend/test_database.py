@@ -0,0 +1,311 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import json
+from unittest import mock
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from backend.app import create_app
+from backend.auth import auth
+from backend.auth.auth import VerifiedPayload
+from backend.cache.cache import response_cache
+from backend.database import pool, slow_queries
+from backend.database.models import db, Movie
+from backend.database.pool import (
+    engine_options, pool_metrics, pool_status, TimedQueuePool, TimedNullPool
+)
+from backend.database.replicas import replica_engine_options
+from backend.database.slow_queries import SlowQueryLog, RateLimiter
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the setup_db engine options test case"""
+
+    def test_postgres_pool_options(self):
+        with mock.patch.multiple(pool, DB_POOL_SIZE=3, DB_STATEMENT_TIMEOUT=5000):
+            options = engine_options("postgresql+psycopg2://u:p@db.example.com/casting")
+
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertEqual(options['connect_args'], {
+            'application_name': 'casting-agency',
+            'options': '-c statement_timeout=5000'
+        })
+
+    def test_replicas_connect_with_a_timeout(self):
+        options = replica_engine_options("postgresql+psycopg2://u:p@replica.example.com/casting")
+        self.assertEqual(options['connect_args']['connect_timeout'], 2)
+        self.assertEqual(options['connect_args']['application_name'], 'casting-agency')
+        self.assertNotIn('connect_args', replica_engine_options("sqlite://"))
+
+    def test_pgbouncer_mode_keeps_no_pool(self):
+        with mock.patch.multiple(pool, DB_PGBOUNCER=True, DB_STATEMENT_TIMEOUT=5000):
+            options = engine_options("postgresql+psycopg2://u:p@pgbouncer/casting")
+
+        self.assertEqual(options, {
+            'poolclass': TimedNullPool,
+            'connect_args': {'application_name': 'casting-agency'}
+        })
+        self.assertTrue(issubclass(TimedNullPool, NullPool))
+
+    def test_sqlite_keeps_defaults(self):
+        self.assertEqual(engine_options("sqlite://"), {})
+
+
+class PoolMetricsTestCase(unittest.TestCase):
+    """This class represents the connection pool metrics test case"""
+
+    def setUp(self):
+        pool_metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = self.make_engine(pool_timeout=0.05)
+
+    def make_engine(self, pool_timeout):
+        return create_engine(
+            f"sqlite:///{self.directory.name}/pool.db",
+            poolclass=TimedQueuePool, pool_size=1, max_overflow=0,
+            pool_timeout=pool_timeout, pool_pre_ping=True
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_counts_checkouts_connects_and_timeouts(self):
+        with self.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            self.assertEqual(pool_status(self.engine)['checked_out'], 1)
+            with self.assertRaises(TimeoutError):
+                self.engine.connect()
+        with self.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+        stats = pool_status(self.engine)
+        self.assertEqual(stats['pool'], 'TimedQueuePool')
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0.05)
+        self.assertEqual(stats['checked_out'], 0)
+
+    def test_counts_wait_for_a_returned_connection(self):
+        self.engine.dispose()
+        self.engine = self.make_engine(pool_timeout=1)
+        connection = self.engine.connect()
+        timer = threading.Timer(0.02, connection.close)
+        timer.start()
+        with self.engine.connect():
+            pass
+        timer.join()
+
+        stats = pool_metrics.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['timeouts'], 0)
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0.02)
+
+
+class HealthTestCase(unittest.TestCase):
+    """This class represents the health endpoint test case"""
+
+    def test_health(self):
+        app = create_app({"database_path": "sqlite://"})
+        res = app.test_client().get("/health")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["data"]["database"], "ok")
+        self.assertIn("checkouts", data["data"]["pool"])
+        self.assertIn("hits", data["data"]["token_cache"])
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = {
+            name: f"sqlite:///{self.directory.name}/{name}.db"
+            for name in ('primary', 'replica_a', 'replica_b')
+        }
+        # every database gets its own movie, to tell where a list was read
+        for name, path in self.paths.items():
+            engine = create_engine(path)
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Movie.__table__.insert(), {"title": name})
+            engine.dispose()
+
+        self.auth_patch = mock.patch.object(
+            auth, 'verify_decode_jwt',
+            return_value=VerifiedPayload({'permissions': ['get:movies', 'post:movies']})
+        )
+        self.auth_patch.start()
+        auth.token_cache.clear()
+        response_cache.clear()
+        self.headers = {'Authorization': 'Bearer test-token'}
+
+    def tearDown(self):
+        self.auth_patch.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.app.extensions['db_replicas'].dispose()
+        self.directory.cleanup()
+
+    def make_app(self, *replicas):
+        self.app = create_app({
+            "database_path": self.paths['primary'],
+            "replica_paths": list(replicas)
+        })
+        return self.app.test_client()
+
+    def read_from(self, client, headers={}):
+        res = client.get("/movies?paginate=false", headers={**self.headers, **headers})
+        self.assertEqual(res.status_code, 200)
+        return [movie["title"] for movie in json.loads(res.data)["data"]]
+
+    def test_reads_round_robin_over_replicas(self):
+        client = self.make_app(self.paths['replica_a'], self.paths['replica_b'])
+        response_cache.enabled = False
+        try:
+            sources = [self.read_from(client)[0] for _ in range(4)]
+        finally:
+            response_cache.enabled = True
+        self.assertEqual(sources, ['replica_a', 'replica_b', 'replica_a', 'replica_b'])
+
+    def test_writes_go_to_primary_and_writers_read_their_writes(self):
+        client = self.make_app(self.paths['replica_a'])
+
+        res = client.post("/movies", json={"title": "New"}, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('read_primary=1', res.headers['Set-Cookie'])
+        # the cookie sent back makes the next read use the primary
+        self.assertEqual(self.read_from(client), ['primary', 'New'])
+
+        client.delete_cookie('read_primary')
+        self.assertEqual(self.read_from(client), ['replica_a'])
+        self.assertEqual(
+            self.read_from(client, headers={'X-Read-Primary': 'true'}),
+            ['primary', 'New']
+        )
+
+    def test_slow_query_log_covers_replicas(self):
+        with mock.patch.object(slow_queries, 'SLOW_QUERY_LOG', True):
+            client = self.make_app(self.paths['replica_a'])
+        slow_query_log = self.app.extensions['slow_query_log']
+        slow_query_log.threshold = 0
+        slow_query_log.explain = True
+
+        with mock.patch.object(slow_query_log, 'explain_plan',
+                               wraps=slow_query_log.explain_plan) as explain_plan, \
+                self.assertLogs("backend.database.slow_queries", "WARNING") as logs:
+            self.assertEqual(self.read_from(client), ['replica_a'])
+            slow_query_log.join()
+
+        self.assertTrue(any('FROM "Movie"' in line for line in logs.output))
+        explained_on = {str(call.args[0].url) for call in explain_plan.call_args_list}
+        self.assertEqual(explained_on, {self.paths['replica_a']})
+
+    def test_csv_copy_export_reads_from_the_replica(self):
+        client = self.make_app(self.paths['replica_a'])
+        auth.verify_decode_jwt.return_value = VerifiedPayload(
+            {'permissions': ['get:movies', 'get:actors']})
+        replica = self.app.extensions['db_replicas'].engines['replica_0']
+        with self.app.app_context():
+            primary = db.engine
+
+        # the COPY path is only taken on psycopg2
+        with mock.patch.object(replica.dialect, 'name', 'postgresql'), \
+                mock.patch.object(replica.dialect, 'driver', 'psycopg2'), \
+                mock.patch.object(replica, 'raw_connection') as replica_connection, \
+                mock.patch.object(primary, 'raw_connection') as primary_connection:
+            res = client.get("/export/castings.csv", headers=self.headers)
+            self.assertEqual(res.status_code, 200)
+            res.get_data()
+
+        copy_expert = replica_connection.return_value.cursor.return_value.copy_expert
+        self.assertEqual(copy_expert.call_count, 2)
+        self.assertTrue(copy_expert.call_args.args[0].startswith('COPY ('))
+        primary_connection.assert_not_called()
+
+    def test_unhealthy_replica_is_skipped(self):
+        client = self.make_app(f"sqlite:///{self.directory.name}/missing/replica.db")
+        self.assertEqual(self.read_from(client), ['primary'])
+        self.assertEqual(self.app.extensions['db_replicas'].status(), {'replica_0': False})
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    """This class represents the slow query log test case"""
+
+    def setUp(self):
+        # a file, the plans are captured on another thread's connection
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.engine = create_engine(f"sqlite:///{self.directory.name}/slow.db")
+        self.addCleanup(self.engine.dispose)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE movie (id INTEGER PRIMARY KEY, title TEXT)"))
+        self.app = create_app({"database_path": "sqlite://"})
+
+    def attach(self, **kwargs):
+        slow_query_log = SlowQueryLog(**kwargs)
+        slow_query_log.attach(self.engine)
+        return slow_query_log
+
+    def test_logs_statement_parameters_route_and_plan(self):
+        slow_query_log = self.attach(threshold_ms=0, explain=True)
+        with self.assertLogs("backend.database.slow_queries", "WARNING") as logs:
+            with self.app.test_request_context("/movies"), self.engine.connect() as conn:
+                conn.execute(text("SELECT title FROM movie WHERE id = :id"), {"id": 7})
+            slow_query_log.join()
+
+        slow, plan = logs.output
+        self.assertIn("on GET /movies:\nSELECT title FROM movie WHERE id = ?", slow)
+        self.assertIn("parameters: (7,)", slow)
+        self.assertIn("plan of slow query on GET /movies", plan)
+        self.assertIn("SEARCH movie USING INTEGER PRIMARY KEY", plan)
+
+    def test_fast_statements_and_writes(self):
+        slow_query_log = self.attach(threshold_ms=60000, explain=True)
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(slow_query_log.logged, 0)
+
+        slow_query_log.threshold = 0
+        with self.assertLogs("backend.database.slow_queries", "WARNING") as logs:
+            with self.engine.begin() as conn:
+                conn.execute(text("INSERT INTO movie (title) VALUES ('New')"))
+            slow_query_log.join()
+        # logged, but never explained: ANALYZE would run it again
+        self.assertEqual(len(logs.output), 1)
+
+    def test_sampling_and_rate_limiting(self):
+        slow_query_log = self.attach(threshold_ms=0, sample_rate=0)
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual((slow_query_log.logged, slow_query_log.dropped), (0, 1))
+
+        slow_query_log = self.attach(threshold_ms=0, max_per_minute=2)
+        with self.assertLogs("backend.database.slow_queries", "WARNING"), \
+                self.engine.connect() as conn:
+            for _ in range(5):
+                conn.execute(text("SELECT 1"))
+        self.assertEqual((slow_query_log.logged, slow_query_log.dropped), (2, 3))
+
+    def test_rate_limiter_refills(self):
+        limiter = RateLimiter(per_minute=60)
+        self.assertEqual(sum(limiter.allow() for _ in range(100)), 60)
+        with mock.patch.object(slow_queries.time, "monotonic", return_value=time.monotonic() + 2):
+            self.assertEqual(sum(limiter.allow() for _ in range(100)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1062 @@
+import os
+import csv
+import subprocess
+import sys
+import gzip
+import tempfile
+import time
+import unittest
+import json
+from datetime import date, datetime
+from unittest import mock
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from werkzeug.datastructures import MultiDict
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from backend.app import create_app
+from backend.auth import auth
+from backend.auth.auth import VerifiedPayload
+from backend.cache.cache import response_cache, ResponseCache, RedisBackend, LRUBackend
+from backend.database.models import db, Movie, Actor, Casting
+from backend.database.queries import _keyset, encode_cursor
+from backend.json_provider import OrjsonProvider, StdlibJSONProvider
+from backend.compression import compression
+from backend.spa.spa import IMMUTABLE
+from backend.metrics import metrics
+from prometheus_client import REGISTRY
+
+PERMISSIONS = [
+    'get:movies', 'post:movies', 'patch:movies', 'delete:movies',
+    'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+    'post:casting'
+]
+
+
+class ApiTestCase(unittest.TestCase):
+    """Base test case running the app on in-memory sqlite with auth stubbed out"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.app = create_app({"database_path": "sqlite://"})
+        self.client = self.app.test_client
+        self.headers = {'Authorization': 'Bearer test-token'}
+        self.payload = VerifiedPayload({'permissions': PERMISSIONS})
+
+        self.auth_patch = mock.patch.object(
+            auth, 'verify_decode_jwt', return_value=self.payload
+        )
+        self.auth_patch.start()
+        auth.token_cache.clear()
+        response_cache.clear()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        self.auth_patch.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def seed(self, movies, actors_per_movie):
+        with self.app.app_context():
+            for m in range(movies):
+                movie = Movie(title=f'Movie {m}', release_date=datetime(2020, 1, 1))
+                db.session.add(movie)
+                for a in range(actors_per_movie):
+                    actor = Actor(name=f'Actor {m}-{a}', age=30, gender='female')
+                    db.session.add(actor)
+                    db.session.flush()
+                    db.session.add(Casting(movie_id=movie.id, actor_id=actor.id))
+            db.session.commit()
+
+    def count_statements(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(res.status_code, 200)
+        return len(statements), json.loads(res.data)
+
+
+
+class QueryTestCase(ApiTestCase):
+    """This class represents the list endpoint query plan test case"""
+
+    def test_get_all_movies_statement_count_is_constant(self):
+        self.seed(movies=2, actors_per_movie=2)
+        small, data = self.count_statements("/movies?paginate=false")
+        self.assertEqual(len(data["data"]), 2)
+        self.assertEqual(len(data["data"][0]["actors"]), 2)
+
+        self.seed(movies=20, actors_per_movie=5)
+        large, data = self.count_statements("/movies?paginate=false")
+        self.assertEqual(len(data["data"]), 22)
+
+        # table versions for the ETag, then the two list statements
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 3)
+
+    def test_movie_cast_is_in_casting_order(self):
+        self.seed(movies=1, actors_per_movie=0)
+        with self.app.app_context():
+            actors = [Actor(name=f'Actor {a}', age=30, gender='female') for a in range(3)]
+            db.session.add_all(actors)
+            db.session.flush()
+            # inserted out of id order
+            for casting_id, actor in zip((30, 10, 20), actors):
+                db.session.add(Casting(id=casting_id, movie_id=1, actor_id=actor.id))
+            db.session.commit()
+
+        res = self.client().get("/movies?paginate=false", headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(
+            [actor["name"] for actor in data["data"][0]["actors"]],
+            ["Actor 1", "Actor 2", "Actor 0"]
+        )
+
+    def test_movie_page_skips_the_cast_of_the_lookahead_row(self):
+        self.seed(movies=3, actors_per_movie=1)
+        parameters = []
+
+        def before_cursor_execute(conn, cursor, statement, params, *args):
+            if 'FROM "Casting"' in statement:
+                parameters.append(params)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get("/movies?limit=2", headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        data = json.loads(res.data)
+        self.assertEqual([movie["id"] for movie in data["data"]], [1, 2])
+        self.assertIsNotNone(data["next"])
+        self.assertEqual(len(parameters), 1)
+        self.assertNotIn(3, parameters[0])
+
+    def test_get_all_actors_statement_count_is_constant(self):
+        self.seed(movies=2, actors_per_movie=2)
+        small, data = self.count_statements("/actors?paginate=false")
+        self.assertEqual(len(data["data"]), 4)
+        self.assertEqual(
+            data["data"][0],
+            {"id": 1, "name": "Actor 0-0", "age": 30, "gender": "female",
+             "movies": [{"id": 1, "title": "Movie 0"}]}
+        )
+
+        self.seed(movies=20, actors_per_movie=5)
+        large, data = self.count_statements("/actors?paginate=false")
+        self.assertEqual(len(data["data"]), 104)
+
+        # table versions for the ETag, then the two list statements
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 3)
+
+
+class PaginationTestCase(ApiTestCase):
+    """This class represents the keyset pagination test case"""
+
+    def walk(self, path):
+        ids, after, pages = [], None, 0
+        while True:
+            url = path if after is None else f"{path}&after={after}"
+            res = self.client().get(url, headers=self.headers)
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data)
+            ids += [row["id"] for row in data["data"]]
+            pages += 1
+            after = data["next"]
+            if after is None:
+                return ids, pages
+
+    def test_movies_pages_cover_every_row_once(self):
+        self.seed(movies=7, actors_per_movie=1)
+        with self.app.app_context():
+            movies = Movie.query.order_by(Movie.id).all()
+            movies[2].release_date = datetime(2019, 1, 1)
+            movies[5].release_date = None
+            db.session.commit()
+
+        ids, pages = self.walk("/movies?limit=3")
+        self.assertEqual(ids, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(pages, 3)
+
+        ids, pages = self.walk("/movies?limit=2&sort=release_date")
+        self.assertEqual(ids, [3, 1, 2, 4, 5, 7, 6])
+
+    def test_actors_pages_cover_every_row_once(self):
+        self.seed(movies=5, actors_per_movie=2)
+
+        ids, pages = self.walk("/actors?limit=4")
+        self.assertEqual(ids, list(range(1, 11)))
+        self.assertEqual(pages, 3)
+
+    def test_page_statement_count_is_constant(self):
+        self.seed(movies=30, actors_per_movie=2)
+        first, _ = self.count_statements("/actors?limit=5")
+        res = self.client().get("/actors?limit=50", headers=self.headers)
+        after = json.loads(res.data)["next"]
+        deep, data = self.count_statements(f"/actors?limit=5&after={after}")
+
+        self.assertEqual(data["data"][0]["id"], 51)
+        self.assertEqual(first, deep)
+
+    def seek_statements(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'ORDER BY' in statement and 'LIMIT' in statement:
+                statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(res.status_code, 200)
+        return statements, json.loads(res.data)
+
+    def test_release_date_pages_seek_without_or(self):
+        self.seed(movies=5, actors_per_movie=0)
+        with self.app.app_context():
+            movies = Movie.query.order_by(Movie.id).all()
+            movies[1].release_date = None
+            movies[3].release_date = None
+            db.session.commit()
+
+        ids, after, queries = [], None, []
+        while True:
+            path = "/movies?limit=2&sort=release_date"
+            statements, data = self.seek_statements(
+                path if after is None else f"{path}&after={after}")
+            queries.append(len(statements))
+            for statement in statements:
+                self.assertNotIn(" OR ", statement)
+            ids += [movie["id"] for movie in data["data"]]
+            after = data["next"]
+            if after is None:
+                break
+
+        self.assertEqual(ids, [1, 3, 5, 2, 4])
+        # the second page runs out of dated movies and continues with the rest
+        self.assertEqual(queries, [1, 2, 1])
+
+    def test_not_null_sort_keys_seek_a_single_row_comparison(self):
+        with self.app.app_context():
+            cases = [(Movie, Movie.query, "title", "Movie 3"),
+                     (Actor, db.select(Actor.id, Actor.name), "name", "Actor 3-0"),
+                     (Actor, db.select(Actor.id, Actor.age), "age", 30)]
+            for model, query, sort, value in cases:
+                queries, _ = _keyset(query, model, sort, encode_cursor(sort, [value, 3]))
+                self.assertEqual(len(queries), 1)
+                statement = getattr(queries[0], "statement", queries[0])
+                sql = str(statement.compile(dialect=postgresql.dialect()))
+                self.assertNotIn(" OR ", sql)
+                self.assertNotIn("IS NULL", sql)
+                self.assertIn(f'("{model.__tablename__}".{sort}, "{model.__tablename__}".id) >', sql)
+
+    def test_unpaginated_response_has_no_cursor(self):
+        self.seed(movies=2, actors_per_movie=1)
+        res = self.client().get("/movies?paginate=false", headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertNotIn("next", data)
+        self.assertEqual(len(data["data"]), 2)
+
+    def test_400_for_invalid_page_args(self):
+        for path in ["/movies?limit=x", "/movies?limit=0", "/actors?after=bogus",
+                     "/movies?sort=age", "/movies?sort=release_date&after=eyJzIjoiaWQiLCJ2IjpbMV19"]:
+            res = self.client().get(path, headers=self.headers)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 400, path)
+            self.assertEqual(data["success"], False)
+
+
+class FilterTestCase(ApiTestCase):
+    """This class represents the list filtering and sorting test case"""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            movies = [
+                Movie(title='The Long Goodbye', release_date=datetime(1973, 3, 7)),
+                Movie(title='Long Day 100%', release_date=datetime(2001, 6, 1)),
+                Movie(title='Short Cuts', release_date=datetime(1993, 10, 1)),
+            ]
+            actors = [
+                Actor(name='Elliott Gould', age=85, gender='male'),
+                Actor(name='Julianne Moore', age=63, gender='female'),
+                Actor(name='Lily Tomlin', age=84, gender='female'),
+            ]
+            db.session.add_all(movies + actors)
+            db.session.flush()
+            db.session.add_all([
+                Casting(movie_id=movies[0].id, actor_id=actors[0].id),
+                Casting(movie_id=movies[2].id, actor_id=actors[1].id),
+                Casting(movie_id=movies[2].id, actor_id=actors[2].id),
+            ])
+            db.session.commit()
+
+    def get(self, path):
+        res = self.client().get(path, headers=self.headers)
+        self.assertEqual(res.status_code, 200, path)
+        return [row["id"] for row in json.loads(res.data)["data"]]
+
+    def test_movie_filters(self):
+        self.assertEqual(self.get("/movies?title_prefix=long"), [2])
+        self.assertEqual(self.get("/movies?title_contains=LONG"), [1, 2])
+        self.assertEqual(self.get("/movies?title_contains=100%25"), [2])
+        self.assertEqual(self.get("/movies?title_contains=0_"), [])
+        self.assertEqual(
+            self.get("/movies?release_date_from=1973-03-07&release_date_to=1993-10-01"),
+            [1, 3]
+        )
+        self.assertEqual(self.get("/movies?actor=2"), [3])
+
+    def test_actor_filters(self):
+        self.assertEqual(self.get("/actors?name_prefix=li"), [3])
+        self.assertEqual(self.get("/actors?name_contains=moo"), [2])
+        self.assertEqual(self.get("/actors?age_min=64&age_max=84"), [3])
+        self.assertEqual(self.get("/actors?gender=female"), [2, 3])
+        self.assertEqual(self.get("/actors?movie=3&gender=female&paginate=false"), [2, 3])
+
+    def test_sorted_pages(self):
+        self.assertEqual(self.get("/movies?sort=title"), [2, 3, 1])
+        self.assertEqual(self.get("/actors?sort=age"), [2, 3, 1])
+
+        res = self.client().get("/actors?sort=name&limit=2", headers=self.headers)
+        after = json.loads(res.data)["next"]
+        self.assertEqual(self.get(f"/actors?sort=name&limit=2&after={after}"), [3])
+
+    def test_400_for_invalid_filters(self):
+        for path in ["/movies?release_date_from=yesterday", "/actors?age_min=old",
+                     "/actors?sort=gender"]:
+            res = self.client().get(path, headers=self.headers)
+            self.assertEqual(res.status_code, 400, path)
+
+
+class CastingTestCase(ApiTestCase):
+    """This class represents the casting constraints test case"""
+
+    def test_422_for_duplicate_casting(self):
+        self.seed(movies=1, actors_per_movie=1)
+
+        res = self.client().post("/casting", json={"movie": 1, "actor": 1}, headers=self.headers)
+
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        with self.app.app_context():
+            self.assertEqual(Casting.query.count(), 1)
+
+    def test_create_casting_in_one_statement(self):
+        self.seed(movies=1, actors_per_movie=1)
+        with self.app.app_context():
+            db.session.add(Actor(name="New", age=20, gender="male"))
+            db.session.commit()
+            engine = db.engine
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            res = self.client().post("/casting", json={"movie": 1, "actor": 2}, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(res.status_code, 200)
+        # the INSERT ... SELECT and the table version bump
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith('INSERT INTO "Casting"'))
+
+    def test_404_for_missing_movie_or_actor(self):
+        self.seed(movies=1, actors_per_movie=1)
+        for body in [{"movie": 1, "actor": 99}, {"movie": 99, "actor": 1}, {}]:
+            res = self.client().post("/casting", json=body, headers=self.headers)
+            self.assertEqual(res.status_code, 404)
+
+    def test_replace_cast(self):
+        self.seed(movies=2, actors_per_movie=2)
+        # movie 1 has actors 1, 2; movie 2 has actors 3, 4
+        res = self.client().put("/movies/1/casting", json={"actors": [2, 3, 4]}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["data"], {"added": [3, 4], "removed": [1]})
+        with self.app.app_context():
+            self.assertEqual(
+                sorted(db.session.execute(
+                    db.select(Casting.actor_id).where(Casting.movie_id == 1)
+                ).scalars()),
+                [2, 3, 4]
+            )
+
+        res = self.client().put("/movies/1/casting", json={"actors": []}, headers=self.headers)
+        self.assertEqual(json.loads(res.data)["data"], {"added": [], "removed": [2, 3, 4]})
+        with self.app.app_context():
+            self.assertEqual(Casting.query.count(), 2)
+
+    def test_replace_cast_errors_write_nothing(self):
+        self.seed(movies=1, actors_per_movie=2)
+
+        res = self.client().put("/movies/1/casting", json={"actors": [1, 99]}, headers=self.headers)
+        self.assertEqual(res.status_code, 422)
+        res = self.client().put("/movies/99/casting", json={"actors": [1]}, headers=self.headers)
+        self.assertEqual(res.status_code, 404)
+        res = self.client().put("/movies/1/casting", json={"actors": ["1"]}, headers=self.headers)
+        self.assertEqual(res.status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(Casting.query.count(), 2)
+
+
+class FakeRedis:
+    """Just enough of the redis client API for RedisBackend"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if key.startswith(match.rstrip('*'))]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class ResponseCacheTestCase(ApiTestCase):
+    """This class represents the list response cache test case"""
+
+    def test_hit_serves_cached_bytes_without_list_queries(self):
+        self.seed(movies=3, actors_per_movie=2)
+        _, first = self.count_statements("/movies?limit=2")
+        statements, second = self.count_statements("/movies?limit=2")
+
+        # only the table versions lookup for the ETag
+        self.assertEqual(first, second)
+        self.assertEqual(statements, 1)
+        self.assertEqual(response_cache.stats()["hits"], 1)
+
+    def test_hit_still_checks_permissions(self):
+        self.seed(movies=1, actors_per_movie=1)
+        self.count_statements("/movies")
+
+        self.payload.permission_set = frozenset(['get:actors'])
+        res = self.client().get("/movies", headers=self.headers)
+        self.assertEqual(res.status_code, 403)
+
+    def test_writes_invalidate_dependent_lists(self):
+        self.seed(movies=1, actors_per_movie=1)
+        self.count_statements("/movies")
+        self.count_statements("/actors")
+
+        res = self.client().post("/actors", json={"name": "New", "age": 20, "gender": "male"},
+                                 headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        actor_statements, data = self.count_statements("/actors")
+        self.assertGreater(actor_statements, 1)
+        self.assertEqual(len(data["data"]), 2)
+
+        res = self.client().patch("/actors/1", json={"name": "Renamed"}, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        _, data = self.count_statements("/movies")
+        self.assertEqual(data["data"][0]["actors"][0]["name"], "Renamed")
+
+        res = self.client().post("/casting", json={"movie": 1, "actor": 2}, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        _, data = self.count_statements("/actors")
+        self.assertEqual(data["data"][1]["movies"], [{"id": 1, "title": "Movie 0"}])
+
+    def test_other_workers_never_serve_stale_bodies(self):
+        # two workers with in-process caches, a write invalidates only the
+        # cache of the worker that handled it
+        worker_a, worker_b = LRUBackend(), LRUBackend()
+        backend = response_cache.backend
+        self.addCleanup(setattr, response_cache, "backend", backend)
+
+        response_cache.backend = worker_b
+        stale = self.client().get("/movies", headers=self.headers)
+        self.assertEqual(stale.get_json()["data"], [])
+
+        response_cache.backend = worker_a
+        res = self.client().post("/movies/bulk", json=[{"title": "New"}], headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+
+        response_cache.backend = worker_b
+        res = self.client().get("/movies", headers=self.headers)
+        self.assertEqual(len(res.get_json()["data"]), 1)
+        self.assertNotEqual(res.headers["ETag"], stale.headers["ETag"])
+        revalidated = self.client().get("/movies", headers=dict(
+            self.headers, **{"If-None-Match": res.headers["ETag"]}))
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_redis_backend(self):
+        cache = ResponseCache(RedisBackend(FakeRedis()), ttl=60)
+        args = MultiDict({"limit": "2"})
+
+        key = cache.key("movies", args)
+        cache.set(key, b'{"success":true}')
+        self.assertEqual(cache.get(cache.key("movies", args)), b'{"success":true}')
+
+        cache.invalidate("movies")
+        self.assertIsNone(cache.get(cache.key("movies", args)))
+
+
+class ETagTestCase(ApiTestCase):
+    """This class represents the conditional GET test case"""
+
+    def test_304_for_matching_etag_without_list_queries(self):
+        self.seed(movies=2, actors_per_movie=1)
+        res = self.client().get("/movies", headers=self.headers)
+        etag = res.headers["ETag"]
+        self.assertTrue(etag.startswith('"'))
+
+        headers = dict(self.headers, **{"If-None-Match": etag})
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            res = self.client().get("/movies", headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(len(statements), 1)
+
+    def test_etag_changes_on_write_and_query(self):
+        self.seed(movies=1, actors_per_movie=1)
+        first = self.client().get("/actors", headers=self.headers).headers["ETag"]
+        other_query = self.client().get("/actors?limit=1", headers=self.headers).headers["ETag"]
+        self.assertNotEqual(first, other_query)
+
+        self.client().delete("/movies/1", headers=self.headers)
+        headers = dict(self.headers, **{"If-None-Match": first})
+        res = self.client().get("/actors", headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], first)
+        self.assertEqual(json.loads(res.data)["data"][0]["movies"], [])
+
+    def test_updated_at_is_maintained(self):
+        self.seed(movies=1, actors_per_movie=0)
+        with self.app.app_context():
+            movie = Movie.query.one()
+            self.assertIsNotNone(movie.updated_at)
+            movie.updated_at = datetime(2000, 1, 1)
+            db.session.commit()
+            movie.title = 'Renamed'
+            db.session.commit()
+            self.assertGreater(movie.updated_at, datetime(2000, 1, 1))
+
+
+class StreamingTestCase(ApiTestCase):
+    """This class represents the streamed list response test case"""
+
+    def test_streamed_lists_match_unpaginated_lists(self):
+        self.seed(movies=12, actors_per_movie=3)
+        with self.app.app_context():
+            db.session.add(Movie(title='Unreleased', release_date=None))
+            db.session.add(Actor(name='Uncast', age=20, gender='male'))
+            db.session.commit()
+
+        for path in ["/movies", "/actors", "/movies?sort=release_date&title_contains=1",
+                     "/actors?sort=name&age_min=21"]:
+            joiner = "&" if "?" in path else "?"
+            expected = self.client().get(path + joiner + "paginate=false", headers=self.headers)
+            streamed = self.client().get(path + joiner + "stream=true", headers=self.headers)
+
+            self.assertEqual(streamed.status_code, 200)
+            self.assertTrue(streamed.is_streamed)
+            self.assertEqual(streamed.get_data(), expected.get_data(), path)
+
+    def test_streamed_list_uses_one_query(self):
+        self.seed(movies=30, actors_per_movie=2)
+        statements, data = self.count_statements("/actors?stream=true")
+
+        self.assertEqual(len(data["data"]), 60)
+        # table versions for the ETag, then the streamed join
+        self.assertEqual(statements, 2)
+
+    def test_empty_streamed_list(self):
+        res = self.client().get("/movies?stream=true", headers=self.headers)
+        self.assertEqual(json.loads(res.data), {"success": True, "data": []})
+
+    def test_400_for_invalid_stream_args(self):
+        res = self.client().get("/movies?stream=true&sort=age", headers=self.headers)
+        self.assertEqual(res.status_code, 400)
+
+
+class ExportTestCase(ApiTestCase):
+    """This class represents the casting graph export test case"""
+
+    def setUp(self):
+        super().setUp()
+        self.seed(movies=3, actors_per_movie=2)
+        with self.app.app_context():
+            db.session.add(Movie(title='Uncast, "quoted"', release_date=None))
+            db.session.add(Actor(name='Unemployed', age=40, gender='male'))
+            db.session.commit()
+
+    def test_ndjson_export(self):
+        res = self.client().get("/export/castings.ndjson", headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[0], {
+            "movie_id": 1, "movie_title": "Movie 0", "movie_release_date": "2020-01-01",
+            "actor_id": 1, "actor_name": "Actor 0-0", "actor_age": 30, "actor_gender": "female"
+        })
+        self.assertEqual(rows[6]["actor_id"], None)
+        self.assertEqual(rows[7]["movie_id"], None)
+        self.assertEqual(rows[7]["actor_name"], "Unemployed")
+
+    def test_gzipped_csv_export(self):
+        headers = dict(self.headers, **{"Accept-Encoding": "gzip"})
+        res = self.client().get("/export/castings.csv", headers=headers)
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        lines = gzip.decompress(res.data).decode().splitlines()
+        rows = list(csv.reader(lines))
+        self.assertEqual(rows[0][:3], ["movie_id", "movie_title", "movie_release_date"])
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows[7][1], 'Uncast, "quoted"')
+
+    def test_export_requires_both_read_permissions(self):
+        self.payload.permission_set = frozenset(['get:movies'])
+        res = self.client().get("/export/castings.csv", headers=self.headers)
+        self.assertEqual(res.status_code, 403)
+
+
+class BulkCreateTestCase(ApiTestCase):
+    """This class represents the bulk create endpoints test case"""
+
+    def test_bulk_create_movies_actors_and_castings(self):
+        movies = [{"title": f"Movie {i}", "release_date": "2024-01-01"} for i in range(50)]
+        res = self.client().post("/movies/bulk", json=movies, headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["data"], list(range(1, 51)))
+
+        actors = {"data": [{"name": "A", "age": "30", "gender": "female"},
+                           {"name": "B", "age": 41, "gender": "male"}]}
+        res = self.client().post("/actors/bulk", json=actors, headers=self.headers)
+        self.assertEqual(json.loads(res.data)["data"], [1, 2])
+
+        castings = [{"movie": m, "actor": a} for m in range(1, 51) for a in (1, 2)]
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            res = self.client().post("/casting/bulk", json=castings, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)["data"]), 100)
+        # validation takes three lookups however many pairs there are (the
+        # insert itself is batched on PostgreSQL, one row per statement on
+        # SQLite which cannot order RETURNING rows)
+        validation = statements[:[s.startswith("INSERT") for s in statements].index(True)]
+        self.assertEqual(len(validation), 3)
+        with self.app.app_context():
+            self.assertEqual(Casting.query.count(), 100)
+
+    def test_422_reports_every_invalid_item_and_writes_nothing(self):
+        self.seed(movies=1, actors_per_movie=1)
+        castings = [
+            {"movie": 1, "actor": 1},
+            {"movie": 1000, "actor": 1},
+            {"movie": "x"},
+            {"movie": 1, "actor": 2},
+        ]
+        with self.app.app_context():
+            db.session.add(Actor(name="Free", age=20, gender="male"))
+            db.session.commit()
+
+        res = self.client().post("/casting/bulk", json=castings, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([error["index"] for error in data["errors"]], [0, 1, 2])
+        self.assertEqual(data["errors"][1]["errors"], {"movie": "not found"})
+        with self.app.app_context():
+            self.assertEqual(Casting.query.count(), 1)
+
+        movies = [{"title": "Fine"}, {"title": "", "release_date": "2025-01-32"}]
+        res = self.client().post("/movies/bulk", json=movies, headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(set(data["errors"][0]["errors"]), {"title", "release_date"})
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 1)
+
+    def test_422_for_non_integral_numbers(self):
+        self.seed(movies=2, actors_per_movie=1)
+        castings = [{"movie": 1.9, "actor": 1}, {"movie": 2, "actor": "1.0"}, {"movie": 2.0, "actor": "1"}]
+        res = self.client().post("/casting/bulk", json=castings, headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["errors"], [
+            {"index": 0, "errors": {"movie": "must be an integer"}},
+            {"index": 1, "errors": {"actor": "must be an integer"}},
+        ])
+
+        actors = [{"name": "A", "age": 30.7, "gender": "female"}]
+        res = self.client().post("/actors/bulk", json=actors, headers=self.headers)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)["errors"][0]["errors"], {"age": "must be an integer"})
+
+    def test_400_for_malformed_bulk_body(self):
+        for body in [{}, [], {"data": "x"}]:
+            res = self.client().post("/actors/bulk", json=body, headers=self.headers)
+            self.assertEqual(res.status_code, 400)
+
+
+class ImportTestCase(ApiTestCase):
+    """This class represents the bulk import CLI test case"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, *args):
+        return self.app.test_cli_runner().invoke(args=['import', *args])
+
+    def test_import_resolves_references_and_reports_rejects(self):
+        movies = self.write('movies.csv', 'title,release_date\nA,2020-01-01\nB,\nB,2021-01-01\n,bad\n')
+        actors = self.write('actors.ndjson',
+                            '{"name": "X", "age": 30, "gender": "female"}\n'
+                            '{"name": "Y", "age": "x"}\n')
+        castings = self.write('castings.csv', 'movie,actor,movie_id\nA,X,\nB,X,\nZ,X,\n,X,2\nA,X,\n')
+
+        result = self.run_import('movies', movies, '--chunk-size', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('3 loaded, 1 rejected of 4 records', result.output)
+        self.assertEqual(self.run_import('actors', actors).exit_code, 0)
+
+        result = self.run_import('castings', castings)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("record 2 rejected: {'movie': 'is ambiguous'}", result.output)
+        self.assertIn("record 3 rejected: {'movie': 'not found'}", result.output)
+        self.assertIn("record 5 rejected: {'actor': 'is already cast in this movie'}", result.output)
+        self.assertIn('2 loaded, 3 rejected of 5 records', result.output)
+        self.assertFalse(os.path.exists(castings + '.checkpoint'))
+
+        with self.app.app_context():
+            self.assertEqual(
+                sorted(tuple(row) for row in db.session.execute(db.select(Casting.movie_id, Casting.actor_id))),
+                [(1, 1), (2, 1)]
+            )
+
+    def test_import_resumes_from_checkpoint(self):
+        movies = self.write('movies.ndjson', ''.join(
+            json.dumps({"title": f"Movie {i}"}) + '\n' for i in range(10)
+        ))
+        from backend.ingest import ingest
+        calls = []
+
+        def failing_insert(model, columns, rows):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise RuntimeError('connection lost')
+            return insert_rows(model, columns, rows)
+
+        insert_rows = ingest.insert_rows
+        with mock.patch.object(ingest, 'insert_rows', failing_insert):
+            result = self.run_import('movies', movies, '--chunk-size', '3', '--method', 'insert')
+        self.assertNotEqual(result.exit_code, 0)
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 6)
+
+        result = self.run_import('movies', movies, '--chunk-size', '3')
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('pass --resume', result.output)
+
+        result = self.run_import('movies', movies, '--chunk-size', '3', '--resume')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('resuming after 6 records', result.output)
+        with self.app.app_context():
+            self.assertEqual(
+                list(db.session.execute(db.select(Movie.title).order_by(Movie.id)).scalars()),
+                [f"Movie {i}" for i in range(10)]
+            )
+
+
+class CompressionTestCase(ApiTestCase):
+    """This class represents the response compression test case"""
+
+    def get(self, path, encoding):
+        return self.client().get(path, headers=dict(self.headers, **{"Accept-Encoding": encoding}))
+
+    def test_gzips_large_responses_only(self):
+        self.seed(movies=30, actors_per_movie=2)
+        plain = self.client().get("/movies?paginate=false", headers=self.headers)
+        self.assertNotIn("Content-Encoding", plain.headers)
+
+        res = self.get("/movies?paginate=false", "br;q=0.5, gzip")
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        etag = res.headers["ETag"]
+        self.assertEqual(etag, plain.headers["ETag"][:-1] + '-gzip"')
+
+        # the 304 carries the validator and Vary the 200 would have sent
+        res = self.client().get("/movies?paginate=false", headers=dict(
+            self.headers, **{"If-None-Match": etag, "Accept-Encoding": "gzip"}))
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+
+        res = self.client().get("/movies?paginate=false", headers=dict(
+            self.headers, **{"If-None-Match": plain.headers["ETag"]}))
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], plain.headers["ETag"])
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+
+        res = self.get("/movies?limit=1", "gzip")
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    def test_gzips_streamed_responses(self):
+        self.seed(movies=30, actors_per_movie=2)
+        plain = self.client().get("/movies?stream=true", headers=self.headers)
+        res = self.get("/movies?stream=true", "gzip")
+
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+    def test_brotli_when_preferred(self):
+        self.seed(movies=30, actors_per_movie=2)
+        res = self.get("/movies?paginate=false", "gzip;q=0.5, br")
+        self.assertEqual(res.headers["Content-Encoding"], "br")
+        self.assertEqual(json.loads(compression.brotli.decompress(res.data))["success"], True)
+
+    def test_serves_precompressed_static_files(self):
+        with tempfile.TemporaryDirectory() as static:
+            script = b"console.log('casting agency');" * 100
+            with open(os.path.join(static, "app.js"), "wb") as file:
+                file.write(script)
+            with open(os.path.join(static, "app.js.gz"), "wb") as file:
+                file.write(gzip.compress(script))
+            self.app.static_folder = static
+
+            res = self.get("/app.js", "gzip, br")
+            self.assertEqual(res.headers["Content-Encoding"], "gzip")
+            self.assertEqual(res.mimetype, "text/javascript")
+            self.assertEqual(gzip.decompress(res.data), script)
+            res.close()
+
+            res = self.get("/app.js", "identity")
+            self.assertNotIn("Content-Encoding", res.headers)
+            self.assertEqual(res.data, script)
+            res.close()
+
+
+class SpaTestCase(ApiTestCase):
+    """This class represents the frontend serving test case"""
+
+    def setUp(self):
+        super().setUp()
+        self.static = tempfile.TemporaryDirectory()
+        self.addCleanup(self.static.cleanup)
+        os.makedirs(os.path.join(self.static.name, "js"))
+        self.write("index.html", b"<div id=app></div>")
+        self.write("js/app.3f2a1b4c.js", b"console.log(1)")
+        self.write("logo.ico", b"ico")
+        self.app.static_folder = self.static.name
+
+    def write(self, name, data):
+        with open(os.path.join(self.static.name, name), "wb") as file:
+            file.write(data)
+
+    def test_serves_client_routes_in_place_from_memory(self):
+        res = self.client().get("/casting")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b"<div id=app></div>")
+        self.assertEqual(res.headers["Cache-Control"], "no-cache")
+        etag = res.headers["ETag"]
+
+        self.write("index.html", b"<div id=other></div>")
+        res = self.client().get("/actors/2/profile", headers={"Accept": "text/html"})
+        self.assertEqual(res.status_code, 404)
+        res = self.client().get("/")
+        self.assertEqual(res.data, b"<div id=app></div>")
+
+        res = self.client().get("/some/client/route", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().get("/casting", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(gzip.decompress(res.data), b"<div id=app></div>")
+        self.assertEqual(res.headers["ETag"], etag[:-1] + '-gzip"')
+
+    def test_api_misses_are_json_404(self):
+        for path in ("/movies/1/unknown", "/export/castings.xml", "/js/app.00000000.js"):
+            res = self.client().get(path)
+            self.assertEqual(res.status_code, 404, path)
+            self.assertEqual(res.get_json(), {"success": False, "error": 404, "message": "Not Found"})
+
+    def test_hashed_assets_are_immutable(self):
+        res = self.client().get("/js/app.3f2a1b4c.js")
+        self.assertEqual(res.headers["Cache-Control"], IMMUTABLE)
+        res.close()
+
+        res = self.client().get("/logo.ico")
+        self.assertNotIn("immutable", res.headers.get("Cache-Control", ""))
+        res.close()
+
+
+class MetricsTestCase(ApiTestCase):
+    """This class represents the request metrics test case"""
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_records_route_sql_and_auth_histograms(self):
+        self.seed(movies=3, actors_per_movie=2)
+        route = {"route": "/movies"}
+        requests_before = self.sample(
+            "http_request_duration_seconds_count", method="GET", route="/movies", status="200")
+        statements_before = self.sample("db_statements_per_request_sum", **route)
+        permissions_before = self.sample("auth_duration_seconds_count", step="permissions")
+
+        statements, _ = self.count_statements("/movies?paginate=false")
+
+        self.assertEqual(self.sample(
+            "http_request_duration_seconds_count", method="GET", route="/movies", status="200"
+        ), requests_before + 1)
+        self.assertEqual(
+            self.sample("db_statements_per_request_sum", **route),
+            statements_before + statements
+        )
+        self.assertEqual(
+            self.sample("auth_duration_seconds_count", step="permissions"), permissions_before + 1)
+
+    def test_counts_token_cache_events(self):
+        # verify_decode_jwt is stubbed, but the cache in front of it is real
+        self.payload["exp"] = time.time() + 60
+        misses = self.sample("auth_token_cache_events_total", event="miss")
+        hits = self.sample("auth_token_cache_events_total", event="hit")
+        for _ in range(3):
+            self.client().get("/actors", headers=self.headers)
+
+        self.assertEqual(self.sample("auth_token_cache_events_total", event="miss"), misses + 1)
+        self.assertEqual(self.sample("auth_token_cache_events_total", event="hit"), hits + 2)
+
+    def test_metrics_endpoint(self):
+        self.client().get("/movies/1/unknown")
+        res = self.client().get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        # labelled with the url rule, not the path
+        self.assertIn(b'route="/<path:filename>",status="404"', res.data)
+        self.assertNotIn(b'/movies/1/unknown', res.data)
+        self.assertNotIn(b'route="/metrics"', res.data)
+
+    def test_metrics_endpoint_requires_the_token_when_set(self):
+        with mock.patch.object(metrics, "METRICS_TOKEN", "scraper-secret"):
+            self.assertEqual(self.client().get("/metrics").status_code, 404)
+            res = self.client().get("/metrics", headers=self.headers)
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(json.loads(res.data)["error"], 404)
+            res = self.client().get(
+                "/metrics", headers={"Authorization": "Bearer scraper-secret"})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn(b'http_request_duration_seconds', res.data)
+
+    def test_server_timing_header(self):
+        res = self.client().get("/actors", headers=self.headers)
+        self.assertNotIn("Server-Timing", res.headers)
+
+        with mock.patch.object(metrics, "SERVER_TIMING", True):
+            res = self.client().get("/actors", headers=self.headers)
+        timing = res.headers["Server-Timing"]
+        self.assertIn("auth-token_cache;dur=", timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn("app;dur=", timing)
+
+    def test_merges_every_worker_process(self):
+        observe = (
+            "from backend.metrics.metrics import SQL_STATEMENTS; "
+            "SQL_STATEMENTS.labels('/movies').observe(3)"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory, DATABASE_URL="sqlite://")
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", observe], env=env, check=True)
+
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                registry = metrics.registry()
+            self.assertEqual(
+                registry.get_sample_value("db_statements_per_request_count", {"route": "/movies"}), 2)
+            self.assertEqual(
+                registry.get_sample_value("db_statements_per_request_sum", {"route": "/movies"}), 6)
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    """This class represents the JSON provider test case"""
+
+    def test_providers_encode_dates_as_iso(self):
+        value = {"b": date(2020, 1, 2), "a": datetime(2020, 1, 2, 3, 4, 5), "c": None}
+        app = create_app({"database_path": "sqlite://"})
+        for provider in (OrjsonProvider(app), StdlibJSONProvider(app)):
+            self.assertEqual(
+                json.loads(provider.dumps(value)),
+                {"a": "2020-01-02T03:04:05", "b": "2020-01-02", "c": None}
+            )
+            self.assertTrue(provider.dumps(value).startswith('{"a"'))
+            with app.app_context():
+                response = provider.response(value)
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertEqual(json.loads(response.get_data())["b"], "2020-01-02")
+
+    def test_movie_release_date_is_serialized_as_before(self):
+        app = create_app({"database_path": "sqlite://"})
+        movie = Movie(id=1, title="A", release_date=datetime(2020, 1, 2))
+        self.assertEqual(
+            json.loads(app.json.dumps(movie.format())),
+            {"id": 1, "title": "A", "release_date": "2020-01-02"}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
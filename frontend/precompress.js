@@ -0,0 +1,47 @@
+// Writes .br and .gz siblings of the compressible files in dist/, served by
+// the backend instead of compressing them on every request.
+// Runs after `vue-cli-service build` (npm run build).
+const fs = require('fs')
+const path = require('path')
+const zlib = require('zlib')
+
+const DIST = path.join(__dirname, 'dist')
+const EXTENSIONS = ['.js', '.css', '.html', '.svg', '.json', '.txt', '.map']
+const MIN_SIZE = 1024
+
+const compressors = {
+    '.br': data => zlib.brotliCompressSync(data, {
+        params: {
+            [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+            [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length
+        }
+    }),
+    '.gz': data => zlib.gzipSync(data, { level: zlib.constants.Z_BEST_COMPRESSION })
+}
+
+function files(directory) {
+    return fs.readdirSync(directory, { withFileTypes: true }).flatMap(entry => {
+        const file = path.join(directory, entry.name)
+        return entry.isDirectory() ? files(file) : [file]
+    })
+}
+
+let written = 0
+for (const file of files(DIST)) {
+    if (!EXTENSIONS.includes(path.extname(file))) {
+        continue
+    }
+    const data = fs.readFileSync(file)
+    if (data.length < MIN_SIZE) {
+        continue
+    }
+    for (const [suffix, compress] of Object.entries(compressors)) {
+        const compressed = compress(data)
+        // a sibling that saves nothing would only cost a lookup
+        if (compressed.length < data.length) {
+            fs.writeFileSync(file + suffix, compressed)
+            written += 1
+        }
+    }
+}
+console.log(`precompress: wrote ${written} .br/.gz files in ${DIST}`)
@@ -0,0 +1,58 @@
+import glob
+import logging
+import os
+import tempfile
+
+## Serving
+'''
+gunicorn settings, read from the environment (see backend/README.md, Serving)
+
+gthread (default): every worker serves WEB_THREADS requests at once, a
+    request waiting on Auth0 or the JWKS endpoint only holds its own thread
+gevent: every worker serves up to WEB_WORKER_CONNECTIONS requests as
+    greenlets; the worker monkey patches the standard library before the app
+    is imported, so requests (login) and urlopen (JWKS) yield while waiting,
+    and psycopg2 is made cooperative with psycogreen (both installed
+    separately: pip install gevent psycogreen)
+sync: one request per worker, as before
+
+Every worker writes its Prometheus metrics to PROMETHEUS_MULTIPROC_DIR (a
+fresh temporary directory unless set), /metrics merges them
+'''
+
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("WEB_THREADS", 4))
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", 100))
+timeout = int(os.getenv("WEB_TIMEOUT", 30))
+keepalive = int(os.getenv("WEB_KEEPALIVE", 5))
+# the app must be imported after gevent patched the worker
+preload_app = False
+
+# set before the workers import prometheus_client, and only created when
+# unset so that a configured directory leaves no empty one behind
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="casting-agency-metrics-")
+
+
+def on_starting(server):
+    # samples left by a previous run would be merged into this one
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    if worker_class != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        logging.getLogger("gunicorn.error").warning(
+            "psycogreen is not installed, database queries block the gevent worker")
+        return
+    patch_psycopg()